@@ -1,12 +1,59 @@
 import platform
 import os
 import sys
-import time
+import atexit
 
 from queue import Queue, Empty
 from threading import Thread
 
 
+class PrintQueue(Queue):
+    """
+    Queue of lines to print with an optional size limit. When it is full,
+    progress lines are handled by the overflow policy: 'block' waits for
+    room, 'drop' throws away the oldest queued progress line and 'coalesce'
+    replaces the last queued line if it is a progress line for the same
+    target, and otherwise waits for room. All other lines wait for room, so
+    errors and failures are never lost.
+    """
+
+    policies = ['block', 'drop', 'coalesce']
+
+    def __init__(self, maxsize=0, policy='block'):
+        Queue.__init__(self, maxsize)
+        self.policy = policy
+        self.dropped = 0
+
+    def putItem(self, item, progress_key=None):
+        with self.not_full:
+            while self.maxsize > 0 and self._qsize() >= self.maxsize:
+                if progress_key is not None:
+                    if self.policy == 'drop' and self.dropOldest():
+                        break
+                    if self.policy == 'coalesce' and self.coalesce(item, progress_key):
+                        return
+                self.not_full.wait()
+            self._put((item, progress_key))
+            self.unfinished_tasks += 1
+            self.not_empty.notify()
+
+    def dropOldest(self):
+        for index, (item, progress_key) in enumerate(self.queue):
+            if progress_key is not None:
+                del self.queue[index]
+                self.dropped += 1
+                return True
+        return False
+
+    def coalesce(self, item, progress_key):
+        # only the last line is replaced so lines still print in order
+        if self.queue and self.queue[-1][1] == progress_key:
+            self.queue[-1] = (item, progress_key)
+            self.dropped += 1
+            return True
+        return False
+
+
 class ColorPrinter():
     """
     Utility class used for printing colored messages.
@@ -14,20 +61,21 @@ class ColorPrinter():
 
     warned = False
     threadStarted = False
-    terminateThread = False
     printThread = None
-    printQueue = Queue()
+    printQueue = PrintQueue()
+    # queued to tell the print thread to exit once everything before it is printed
+    stopItem = object()
 
     def __init__(self, size=1):
         self.size = size
 
         if not ColorPrinter.threadStarted:
-            ColorPrinter.terminateThread = False
             ColorPrinter.printThread = Thread(
                 target=ColorPrinter.printQueueThread)
             ColorPrinter.printThread.daemon = True
             ColorPrinter.threadStarted = True
             ColorPrinter.printThread.start()
+            atexit.register(ColorPrinter.cleanUpPrinter)
 
         try:
             from colorama import init
@@ -41,7 +89,7 @@ class ColorPrinter():
         except ImportError:
             if "windows" in platform.system().lower():
                 if not ColorPrinter.warned:
-                    ColorPrinter.printQueue.put(
+                    ColorPrinter.printQueue.putItem(
                         "[!WARN!!] Failed to import colorama, build output will be uncolored.")
                     ColorPrinter.warned = True
                 self.HEADER = ''
@@ -59,20 +107,49 @@ class ColorPrinter():
                 self.ENDC = '\033[0m'
 
     def cleanUpPrinter():
-        ColorPrinter.terminateThread = True
-        ColorPrinter.printThread.join()
+        """
+        Prints everything queued so far and stops the print thread.
+        """
+        if ColorPrinter.printThread and ColorPrinter.printThread.is_alive():
+            ColorPrinter.printQueue.putItem(ColorPrinter.stopItem)
+            ColorPrinter.printThread.join()
+            if ColorPrinter.printQueue.dropped:
+                sys.stdout.write(ColorPrinter().InfoString(
+                    " " + str(ColorPrinter.printQueue.dropped) +
+                    " progress lines were dropped to keep up with the build.") + os.linesep)
+        sys.stdout.flush()
+
+    def SetQueueLimit(maxsize, policy='block'):
+        """
+        Limits the number of lines waiting to be printed, see PrintQueue for
+        the overflow policies.
+        """
+        if policy not in PrintQueue.policies:
+            raise ValueError("Unknown print queue policy: " + str(policy))
+        with ColorPrinter.printQueue.mutex:
+            ColorPrinter.printQueue.maxsize = maxsize
+            ColorPrinter.printQueue.policy = policy
+            ColorPrinter.printQueue.not_full.notify_all()
 
     def printQueueThread():
         while True:
-            time.sleep(0.001)
-            while not ColorPrinter.printQueue.empty():
+            # sleep until something is queued, then write out everything
+            # pending in one go
+            printItems = [ColorPrinter.printQueue.get()[0]]
+            while True:
                 try:
-                    printItem = ColorPrinter.printQueue.get(
-                        block=False)
-                    sys.stdout.write(printItem + os.linesep)
+                    printItems.append(
+                        ColorPrinter.printQueue.get(block=False)[0])
                 except Empty:
-                    pass
-            if ColorPrinter.terminateThread:
+                    break
+
+            stop = ColorPrinter.stopItem in printItems
+            if stop:
+                printItems = printItems[:printItems.index(ColorPrinter.stopItem)]
+            if printItems:
+                sys.stdout.write(os.linesep.join(printItems) + os.linesep)
+                sys.stdout.flush()
+            if stop:
                 break
 
     def SetSize(self, size):
@@ -82,7 +159,7 @@ class ColorPrinter():
         """
         Put something in the print queue to be printed.
         """
-        ColorPrinter.printQueue.put(item)
+        ColorPrinter.printQueue.putItem(item)
 
     def highlight_word(self, line, word, color):
         """
@@ -94,13 +171,13 @@ class ColorPrinter():
         """
         Prints a purple info message.
         """
-        ColorPrinter.printQueue.put(self.InfoString(message))
+        ColorPrinter.printQueue.putItem(self.InfoString(message))
 
     def CppCheckPrint(self, message):
         """
         Prints a purple info message.
         """
-        ColorPrinter.printQueue.put(
+        ColorPrinter.printQueue.putItem(
             self.HEADER + "[CPPCHK!]" + self.ENDC + message)
 
     def InfoString(self, message):
@@ -113,7 +190,7 @@ class ColorPrinter():
         """
         Prints a red error message.
         """
-        ColorPrinter.printQueue.put(
+        ColorPrinter.printQueue.putItem(
             self.FAIL + "[  ERROR] " + self.ENDC + message)
 
     def CompilePrint(self, percent, build, message):
@@ -128,20 +205,20 @@ class ColorPrinter():
         print_string = self.OKGREEN + \
             "[" + percent_string + "%]" + self.OKBLUE + \
             "[ " + build + " ] " + self.ENDC + message
-        ColorPrinter.printQueue.put(print_string)
+        ColorPrinter.printQueue.putItem(print_string, progress_key=build)
 
     def LinkPrint(self, build, message):
         """
         Prints a linked message, including a green link prefix.
         """
-        ColorPrinter.printQueue.put(self.OKGREEN + "[ LINK!!]" + self.OKBLUE +
-                                    "[ " + build + " ] " + self.ENDC + message)
+        ColorPrinter.printQueue.putItem(self.OKGREEN + "[ LINK!!]" + self.OKBLUE +
+                                        "[ " + build + " ] " + self.ENDC + message)
 
     def TestPassPrint(self, message):
         """
         Prints a test result message.
         """
-        ColorPrinter.printQueue.put(
+        ColorPrinter.printQueue.putItem(
             self.OKGREEN + "[ PASS!!]" + self.ENDC + message)
 
     def TestResultPrint(self, message):
@@ -150,14 +227,14 @@ class ColorPrinter():
         """
         results_lines = message.split(os.linesep)
         for line in results_lines:
-            ColorPrinter.printQueue.put(
+            ColorPrinter.printQueue.putItem(
                 self.OKBLUE + "[RESULTS] " + self.ENDC + line)
 
     def TestFailPrint(self, message):
         """
         Prints a test result message.
         """
-        ColorPrinter.printQueue.put(
+        ColorPrinter.printQueue.putItem(
             self.FAIL + "[ FAIL!!]" + self.ENDC + message)
 
     def ConfigString(self, message):
@@ -1,12 +1,36 @@
 import re
+import os
+import json
+import hashlib
+import shutil
+import inspect
+import platform
+import collections
+import tempfile
+import functools
+import threading
+import subprocess
+from multiprocessing.pool import ThreadPool
 
 from BuildUtils.ColorPrinter import ColorPrinter
+from BuildUtils import get_cache_dir, get_num_cpus, get_toolchain_fingerprint
 
 from SCons.Conftest import _lang2suffix, _YesNoResult
 
 p = ColorPrinter()
 
 
+def Warn(context, lines):
+    """
+    Prints a configure warning, also handing it to the context so the
+    warning can be repeated when the check result comes from a cache.
+    """
+    for line in lines:
+        p.PrintItem(p.ConfigString(line))
+    if hasattr(context, 'warnings'):
+        context.warnings.extend(lines)
+
+
 def CheckHeader(context, header_name, header=None, language=None,
                 include_quotes=None):
     """
@@ -407,11 +431,9 @@ def CheckVsnStdio(context):
     context.Result(result)
     if not result:
         context.env.Append(CPPDEFINES=["NO_vsnprintf"])
-        p.PrintItem(p.ConfigString(
-            "  WARNING: vsnprintf() not found, falling back to vsprintf()."))
-        p.PrintItem(p.ConfigString(
-            "  Can build but will be open to possible buffer-overflow security"))
-        p.PrintItem(p.ConfigString("  vulnerabilities."))
+        Warn(context, ["  WARNING: vsnprintf() not found, falling back to vsprintf().",
+                       "  Can build but will be open to possible buffer-overflow security",
+                       "  vulnerabilities."])
     return result
 
 
@@ -440,11 +462,9 @@ def CheckVsnprintfReturn(context):
     context.Result(result)
     if not result:
         context.env.Append(CPPDEFINES=["HAS_vsnprintf_void"])
-        p.PrintItem(p.ConfigString(
-            "  WARNING: apparently vsnprintf() does not return a value."))
-        p.PrintItem(p.ConfigString(
-            "  Can build but will be open to possible string-format security"))
-        p.PrintItem(p.ConfigString("  vulnerabilities."))
+        Warn(context, ["  WARNING: apparently vsnprintf() does not return a value.",
+                       "  Can build but will be open to possible string-format security",
+                       "  vulnerabilities."])
     return result
 
 
@@ -473,11 +493,9 @@ def CheckVsprintfReturn(context):
     context.Result(result)
     if not result:
         context.env.Append(CPPDEFINES=["HAS_vsprintf_void"])
-        p.PrintItem(p.ConfigString(
-            "  WARNING: apparently vsprintf() does not return a value."))
-        p.PrintItem(p.ConfigString(
-            "  Can build but will be open to possible string-format security"))
-        p.PrintItem(p.ConfigString("  vulnerabilities."))
+        Warn(context, ["  WARNING: apparently vsprintf() does not return a value.",
+                       "  Can build but will be open to possible string-format security",
+                       "  vulnerabilities."])
     return result
 
 
@@ -500,11 +518,9 @@ def CheckSnStdio(context):
     context.Result(result)
     if not result:
         context.env.Append(CPPDEFINES=["NO_snprintf"])
-        p.PrintItem(p.ConfigString(
-            "  WARNING: snprintf() not found, falling back to sprintf()."))
-        p.PrintItem(p.ConfigString(
-            "  Can build but will be open to possible buffer-overflow security"))
-        p.PrintItem(p.ConfigString("  vulnerabilities."))
+        Warn(context, ["  WARNING: snprintf() not found, falling back to sprintf().",
+                       "  Can build but will be open to possible buffer-overflow security",
+                       "  vulnerabilities."])
     return result
 
 
@@ -527,11 +543,9 @@ def CheckSnprintfReturn(context):
     context.Result(result)
     if not result:
         context.env.Append(CPPDEFINES=["HAS_snprintf_void"])
-        p.PrintItem(p.ConfigString(
-            "  WARNING: apparently snprintf() does not return a value."))
-        p.PrintItem(p.ConfigString(
-            "  Can build but will be open to possible string-format security"))
-        p.PrintItem(p.ConfigString("  vulnerabilities."))
+        Warn(context, ["  WARNING: apparently snprintf() does not return a value.",
+                       "  Can build but will be open to possible string-format security",
+                       "  vulnerabilities."])
     return result
 
 
@@ -554,11 +568,9 @@ def CheckSprintfReturn(context):
     context.Result(result)
     if not result:
         context.env.Append(CPPDEFINES=["HAS_sprintf_void"])
-        p.PrintItem(p.ConfigString(
-            "  WARNING: apparently sprintf() does not return a value."))
-        p.PrintItem(p.ConfigString(
-            "  Can build but will be open to possible string-format security"))
-        p.PrintItem(p.ConfigString("  vulnerabilities."))
+        Warn(context, ["  WARNING: apparently sprintf() does not return a value.",
+                       "  Can build but will be open to possible string-format security",
+                       "  vulnerabilities."])
     return result
 
 
@@ -578,3 +590,429 @@ def CheckHidden(context):
     if result:
         context.env.Append(CPPDEFINES=["HAVE_HIDDEN"])
     return result
+
+
+# compile settings a check must leave alone before its TryCompile for its
+# snippet to be compiled together with other checks
+BATCH_FLAG_VARS = ['CC', 'CXX', 'CCFLAGS', 'CFLAGS', 'CXXFLAGS', 'CPPFLAGS',
+                   'CPPDEFINES', 'CPPPATH']
+
+# file scope names defined by the check snippets, renamed for each snippet so
+# they can share a translation unit
+BATCH_RENAMED_SYMBOLS = ['main', 'dummy', 'foo', 'hello', 'mytest',
+                         'memory_barrier', 'atomic_add', 'atomic_ptr_cmpxchg',
+                         'mutex_trylock', 'mutex_unlock']
+
+
+def _FlagsSnapshot(env):
+    return [env.subst('$' + var) for var in BATCH_FLAG_VARS]
+
+
+class _ProbeContext(object):
+    """
+    Stand-in for a check context which records what the check would compile,
+    without compiling anything or touching the real environment.
+    """
+
+    probing = True
+
+    def __init__(self, context):
+        self.context = context
+        self.env = context.env.Clone()
+        self.flags = _FlagsSnapshot(self.env)
+        self.compiles = []
+        self.batchable = True
+
+    def __getattr__(self, name):
+        return getattr(self.context, name)
+
+    def Message(self, text):
+        pass
+
+    def Result(self, res):
+        pass
+
+    def Display(self, msg):
+        pass
+
+    def Log(self, msg):
+        pass
+
+    def TryCompile(self, text, extension):
+        if _FlagsSnapshot(self.env) != self.flags:
+            self.batchable = False
+        self.compiles.append((text, extension))
+        return 1
+
+    def TryBuild(self, *args, **kw):
+        self.batchable = False
+        return 1
+
+    TryLink = TryAction = TryBuild
+
+    def TryRun(self, *args, **kw):
+        self.batchable = False
+        return (1, '')
+
+
+class _ReplayContext(object):
+    """
+    Context handing a check the TryCompile result already found for it, with
+    everything else going to the real context.
+    """
+
+    def __init__(self, context, result):
+        self.context = context
+        self.result = result
+
+    def __getattr__(self, name):
+        return getattr(self.context, name)
+
+    def TryCompile(self, text, extension):
+        return self.result
+
+
+def _ProbeCheck(context, check, args):
+    """
+    Get the (text, extension) a check compiles if it does nothing but a
+    single TryCompile with the current flags, otherwise None.
+    """
+    probe = _ProbeContext(context)
+    try:
+        check(probe, *args)
+    except Exception:
+        return None
+    if probe.batchable and len(probe.compiles) == 1:
+        return probe.compiles[0]
+    return None
+
+
+def _CheckName(check):
+    return getattr(check, '__name__', repr(check))
+
+
+def _RunChecks(context, checks, resolve):
+    """
+    Run checks in order, finding the TryCompile results of each run of
+    simple checks up front with resolve(context, snippets) and handing every
+    check its result. A check can be given as (check, [dependencies]), it is
+    then called with the results of the dependencies, which must come
+    earlier in the list.
+    """
+    order = []
+    positions = {}
+    for check in checks:
+        if isinstance(check, tuple):
+            check, dependencies = check
+        else:
+            dependencies = []
+        for dependency in dependencies:
+            if dependency not in positions:
+                raise ValueError("Check %s depends on %s, which is not an earlier check in the list"
+                                 % (_CheckName(check), _CheckName(dependency)))
+        order.append((check, [positions[dependency]
+                              for dependency in dependencies]))
+        positions[check] = len(order) - 1
+
+    results = []
+
+    def run(check_context):
+        check, dependencies = order[len(results)]
+        results.append(check(check_context,
+                             *[results[dependency] for dependency in dependencies]))
+
+    while len(results) < len(order):
+        start = len(results)
+        snippets = []
+        for check, dependencies in order[start:]:
+            if any(dependency >= start for dependency in dependencies):
+                break
+            snippet = _ProbeCheck(
+                context, check, [results[dependency] for dependency in dependencies])
+            if not snippet or (snippets and snippet[1] != snippets[0][1]):
+                break
+            snippets.append(snippet)
+
+        if len(snippets) < 2:
+            run(context)
+            continue
+
+        for result in resolve(context, snippets):
+            flags = _FlagsSnapshot(context.env)
+            run(_ReplayContext(context, result))
+            # the rest were compiled with outdated flags
+            if _FlagsSnapshot(context.env) != flags:
+                break
+    return results
+
+
+def _BatchSource(snippets):
+    text = ''
+    for index, snippet in enumerate(snippets):
+        for symbol in BATCH_RENAMED_SYMBOLS:
+            text += '#define %s batch%d_%s\n' % (symbol, index, symbol)
+        text += snippet + '\n'
+        for symbol in BATCH_RENAMED_SYMBOLS:
+            text += '#undef %s\n' % symbol
+    return text
+
+
+def _CompileBatch(context, snippets):
+    """
+    Get the TryCompile result of each snippet, compiling them all in one
+    translation unit and bisecting only when that fails.
+    """
+    if len(snippets) == 1:
+        return [context.TryCompile(*snippets[0])]
+
+    result = context.TryCompile(
+        _BatchSource([text for text, extension in snippets]), snippets[0][1])
+    if result:
+        return [result] * len(snippets)
+    half = len(snippets) // 2
+    return (_CompileBatch(context, snippets[:half])
+            + _CompileBatch(context, snippets[half:]))
+
+
+def CheckBatch(context, checks):
+    """
+    Run a list of checks, compiling the snippets of the ones that only do a
+    TryCompile together in one translation unit instead of one compiler run
+    each. Each check is then run against its result, so the messages and env
+    changes are the same as running the checks one after another, and once a
+    check changes the compile flags the rest are batched again.
+    Returns the list of check results.
+
+    conf = Configure(env, custom_tests={'CheckBatch': CheckBatch})
+    conf.CheckBatch([CheckUnistdH, CheckStdargH, CheckSizeT, CheckFseeko])
+    """
+    return _RunChecks(context, checks, _CompileBatch)
+
+
+def _CompileConcurrently(context, snippets, jobs):
+    """
+    Get the TryCompile result of each snippet by running the compiler on all
+    of them at once, each in its own temp dir. The compiler runs from the
+    top dir like SCons runs it, so relative include paths still resolve.
+    """
+    env = context.env
+    commands = []
+    for text, extension in snippets:
+        temp_dir = tempfile.mkdtemp(prefix='conftest_')
+        source = os.path.join(temp_dir, 'conftest' + extension)
+        target = os.path.join(
+            temp_dir, 'conftest' + env.subst('$OBJSUFFIX'))
+        with open(source, 'w') as f:
+            f.write(text)
+        if extension == '.c':
+            command = '$CCCOM'
+        else:
+            command = '$CXXCOM'
+        commands.append((temp_dir, text, env.subst(
+            command, target=env.File(target), source=env.File(source))))
+
+    process_env = dict((key, str(value))
+                       for key, value in env['ENV'].items())
+    top_dir = env.Dir('#').abspath
+
+    def compile(command):
+        temp_dir, text, command_line = command
+        proc = subprocess.Popen(command_line,
+                                shell=True,
+                                cwd=top_dir,
+                                env=process_env,
+                                stdout=subprocess.PIPE,
+                                stderr=subprocess.STDOUT)
+        output = proc.communicate()[0].decode('utf8', 'replace')
+        shutil.rmtree(temp_dir, ignore_errors=True)
+        return proc.returncode, output
+
+    pool = ThreadPool(processes=min(len(commands), jobs or get_num_cpus()))
+    try:
+        compiled = pool.map(compile, commands)
+    finally:
+        pool.close()
+        pool.join()
+
+    results = []
+    for (temp_dir, text, command_line), (returncode, output) in zip(commands, compiled):
+        context.Log(text + '\n' + command_line + '\n' + output + '\n')
+        results.append(int(returncode == 0))
+    return results
+
+
+def CheckParallel(context, checks, jobs=None):
+    """
+    Run a list of checks, compiling the ones that only do a TryCompile all at
+    once on up to jobs workers (the number of CPUs by default). Checks given
+    as (check, [dependencies]) are called with the results of the
+    dependencies, and every check is run against its result in list order, so
+    the messages and env changes are the same as running them one after
+    another. Returns the list of check results.
+
+    conf = Configure(env, custom_tests={'CheckParallel': CheckParallel})
+    conf.CheckParallel([CheckUnistdH, CheckStdargH, CheckSizeTLongLong,
+                        (CheckSizeTPointerSize, [CheckSizeTLongLong])])
+    """
+    return _RunChecks(context, checks,
+                      lambda context, snippets: _CompileConcurrently(context, snippets, jobs))
+
+
+# settings that decide the outcome of a check besides the compiler itself
+CHECK_CACHE_FLAG_VARS = ['CCFLAGS', 'CFLAGS', 'CXXFLAGS', 'CPPFLAGS',
+                         'CPPDEFINES', 'CPPPATH', 'LINKFLAGS', 'LIBPATH', 'LIBS']
+
+# env variables whose changes by a check are stored with its cached result
+CHECK_CACHE_ENV_VARS = CHECK_CACHE_FLAG_VARS + ['SHLINKFLAGS']
+
+_check_cache_lock = threading.Lock()
+
+
+class _RecordingContext(object):
+    """
+    Context passing everything on to the real context while recording the
+    messages, results and warnings a check shows.
+    """
+
+    def __init__(self, context):
+        self.context = context
+        self.calls = []
+        self.warnings = []
+
+    def __getattr__(self, name):
+        return getattr(self.context, name)
+
+    def Message(self, text):
+        self.calls.append(['Message', text])
+        self.context.Message(text)
+
+    def Result(self, res):
+        self.calls.append(['Result', res])
+        self.context.Result(res)
+
+
+def _CheckCacheFile(env):
+    return env.get('CONFIGURE_CHECK_CACHE',
+                   os.path.join(get_cache_dir(), 'configure_checks.json'))
+
+
+def _CheckCacheKey(context, check, args):
+    try:
+        source = inspect.getsource(check)
+    except (IOError, TypeError):
+        source = check.__name__
+    key = hashlib.sha1()
+    key.update(get_toolchain_fingerprint(
+        context.env, CHECK_CACHE_FLAG_VARS).encode('utf8'))
+    key.update(json.dumps([check.__name__, source, repr(args),
+                           platform.machine()]).encode('utf8'))
+    return key.hexdigest()
+
+
+def _PlainValue(value):
+    """
+    Copy an env value with its sequences as lists, SCons changes some of
+    them in place (CPPDEFINES is a deque since SCons 4.5, flags are
+    CLVars) and they have to be stored as JSON.
+    """
+    if isinstance(value, (list, tuple, collections.deque, collections.UserList)):
+        return [_PlainValue(item) for item in value]
+    return value
+
+
+def _EnvSnapshot(env):
+    snapshot = {}
+    for var in CHECK_CACHE_ENV_VARS:
+        if var in env:
+            snapshot[var] = _PlainValue(env[var])
+    return snapshot
+
+
+def _EnvChanges(before, after):
+    """
+    Describe how a check changed the env as ['append', values] or
+    ['replace', value] per variable.
+    """
+    changes = {}
+    for var in after:
+        if var in before and before[var] == after[var]:
+            continue
+        if (isinstance(before.get(var), list) and isinstance(after[var], list)
+                and after[var][:len(before[var])] == before[var]):
+            changes[var] = ['append', after[var][len(before[var]):]]
+        else:
+            changes[var] = ['replace', after[var]]
+    return changes
+
+
+def _ReplayCachedCheck(context, entry):
+    for call, value in entry['calls']:
+        getattr(context, call)(value)
+    # a probe runs the check again later, which prints the warnings then
+    if not getattr(context, 'probing', False):
+        for line in entry['warnings']:
+            p.PrintItem(p.ConfigString(line))
+    if hasattr(context, 'warnings'):
+        context.warnings.extend(entry['warnings'])
+    for var, (change, value) in entry['env'].items():
+        if change == 'append':
+            context.env.Append(**{var: value})
+        else:
+            context.env.Replace(**{var: value})
+    return entry['result']
+
+
+def CachedCheck(check):
+    """
+    Wrap a check so its result is kept in a persistent cache, keyed by the
+    compiler binaries, their version output, the flags and the check's source.
+    A cached result repeats the check's messages, warnings and env changes
+    without compiling anything. The cache is $CONFIGURE_CHECK_CACHE or
+    configure_checks.json in the BuildUtils cache dir.
+
+    conf = Configure(env, custom_tests={'CheckStdCpp11': CachedCheck(CheckStdCpp11)})
+    """
+    @functools.wraps(check)
+    def cachedCheck(context, *args):
+        key = _CheckCacheKey(context, check, args)
+        cache_file = _CheckCacheFile(context.env)
+        with _check_cache_lock:
+            try:
+                with open(cache_file) as f:
+                    entry = json.load(f).get(key)
+            except (IOError, ValueError):
+                entry = None
+        if entry:
+            return _ReplayCachedCheck(context, entry)
+
+        # only the real run of a check may be cached, not CheckBatch probing it
+        if getattr(context, 'probing', False):
+            return check(context, *args)
+
+        recorder = _RecordingContext(context)
+        before = _EnvSnapshot(context.env)
+        result = check(recorder, *args)
+        entry = {
+            'result': result,
+            'calls': recorder.calls,
+            'warnings': recorder.warnings,
+            'env': _EnvChanges(before, _EnvSnapshot(context.env)),
+        }
+        try:
+            json.dumps(entry)
+        except TypeError:
+            return result
+
+        with _check_cache_lock:
+            try:
+                with open(cache_file) as f:
+                    cache = json.load(f)
+            except (IOError, ValueError):
+                cache = {}
+            cache[key] = entry
+            temp_file = cache_file + '.tmp'
+            with open(temp_file, 'w') as f:
+                json.dump(cache, f, indent=2)
+            os.replace(temp_file, cache_file)
+        return result
+    return cachedCheck
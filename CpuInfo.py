@@ -0,0 +1,194 @@
+# This file is licensed under the MIT License.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+"""
+Functions to find the CPUs a build can use.
+"""
+
+# python
+import os
+import glob
+import subprocess
+
+# the CPU info of this process, keyed by pid so forked children look again
+_cpu_info = {}
+
+
+def ReadFirstLine(path):
+    """
+    Read the first line of a file, or None if it can't be read.
+    """
+    try:
+        with open(path) as f:
+            return f.readline().strip()
+    except (IOError, OSError):
+        return None
+
+
+def CgroupPaths(controller):
+    """
+    Get the directories that may hold this process's cgroup files for a
+    controller, v2 first.
+    """
+    paths = []
+    try:
+        with open('/proc/self/cgroup') as f:
+            for line in f:
+                parts = line.strip().split(':', 2)
+                if len(parts) != 3:
+                    continue
+                if parts[0] == '0' and parts[1] == '':
+                    paths.insert(0, '/sys/fs/cgroup' + parts[2])
+                elif controller in parts[1].split(','):
+                    paths.append('/sys/fs/cgroup/' + parts[1] + parts[2])
+    except (IOError, OSError):
+        pass
+    return paths + ['/sys/fs/cgroup', '/sys/fs/cgroup/' + controller]
+
+
+def CgroupCpuLimit():
+    """
+    Get the number of CPUs a cgroup v1 or v2 CPU quota allows, or None.
+    """
+    for path in CgroupPaths('cpu'):
+        cpu_max = ReadFirstLine(path + '/cpu.max')
+        if cpu_max:
+            quota, period = (cpu_max.split() + ['100000'])[:2]
+            if quota == 'max':
+                return None
+            return max(1, -(-int(quota) // int(period)))
+        quota = ReadFirstLine(path + '/cpu.cfs_quota_us')
+        period = ReadFirstLine(path + '/cpu.cfs_period_us')
+        if quota and period:
+            if int(quota) <= 0:
+                return None
+            return max(1, -(-int(quota) // int(period)))
+    return None
+
+
+def ParseCpuList(cpulist):
+    """
+    Parse a kernel CPU list such as 0-3,8-11.
+    """
+    cpus = []
+    for part in cpulist.split(','):
+        part = part.strip()
+        if not part:
+            continue
+        if '-' in part:
+            first, last = part.split('-')
+            cpus.extend(range(int(first), int(last) + 1))
+        else:
+            cpus.append(int(part))
+    return cpus
+
+
+def Sysctl(name):
+    """
+    Read a number from sysctl on OSX and BSD, or None.
+    """
+    try:
+        return int(subprocess.check_output(['sysctl', '-n', name],
+                                           stderr=subprocess.STDOUT).strip())
+    except (OSError, ValueError, subprocess.CalledProcessError):
+        return None
+
+
+def LogicalCpus():
+    """
+    Get the number of logical CPUs online.
+    """
+    ncpus = None
+    if hasattr(os, 'sysconf') and 'SC_NPROCESSORS_ONLN' in os.sysconf_names:
+        ncpus = os.sysconf('SC_NPROCESSORS_ONLN')
+    if not ncpus or ncpus < 1:
+        ncpus = Sysctl('hw.logicalcpu') or Sysctl('hw.ncpu')
+    if not ncpus and 'NUMBER_OF_PROCESSORS' in os.environ:
+        ncpus = int(os.environ['NUMBER_OF_PROCESSORS'])
+    if not ncpus:
+        ncpus = os.cpu_count()
+    return max(1, ncpus or 1)
+
+
+def PhysicalCores(logical=None):
+    """
+    Get the number of physical cores, without hyperthreads.
+    """
+    cores = set()
+    for topology in glob.glob('/sys/devices/system/cpu/cpu[0-9]*/topology'):
+        core = ReadFirstLine(topology + '/core_id')
+        package = ReadFirstLine(topology + '/physical_package_id')
+        if core is not None:
+            cores.add((package, core))
+    if cores:
+        return len(cores)
+    return Sysctl('hw.physicalcpu') or logical or LogicalCpus()
+
+
+def NumaNodes(logical=None):
+    """
+    Get the CPUs of each NUMA node, a single node holding every CPU if the
+    system has no NUMA layout.
+    """
+    nodes = {}
+    for node_dir in glob.glob('/sys/devices/system/node/node[0-9]*'):
+        cpulist = ReadFirstLine(node_dir + '/cpulist')
+        if cpulist:
+            nodes[int(os.path.basename(node_dir)[4:])] = ParseCpuList(cpulist)
+    if not nodes:
+        nodes[0] = list(range(logical or LogicalCpus()))
+    return nodes
+
+
+def GetCpuInfo():
+    """
+    Get the logical CPUs, physical cores, CPUs this process may use after
+    its affinity mask and cgroup quota, and NUMA node layout. Worked out
+    once per process.
+    """
+    pid = os.getpid()
+    if pid in _cpu_info:
+        return _cpu_info[pid]
+
+    logical = LogicalCpus()
+    if hasattr(os, 'sched_getaffinity'):
+        affinity = sorted(os.sched_getaffinity(0))
+    else:
+        affinity = list(range(logical))
+    usable = len(affinity) or logical
+    cgroup_limit = CgroupCpuLimit()
+    if cgroup_limit:
+        usable = min(usable, cgroup_limit)
+
+    numa_nodes = {}
+    for node, cpus in NumaNodes(logical).items():
+        node_cpus = [cpu for cpu in cpus if cpu in affinity]
+        if node_cpus:
+            numa_nodes[node] = node_cpus
+
+    _cpu_info.clear()
+    _cpu_info[pid] = {
+        'logical': logical,
+        'physical': PhysicalCores(logical),
+        'usable': max(1, usable),
+        'affinity': affinity,
+        'cgroup_limit': cgroup_limit,
+        'numa_nodes': numa_nodes,
+    }
+    return _cpu_info[pid]
+
+
+def UsableCpus():
+    """
+    Get the number of CPUs this process may run jobs on.
+    """
+    return GetCpuInfo()['usable']
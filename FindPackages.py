@@ -16,6 +16,7 @@ Utility functios used for find packages.
 
 # python
 from BuildUtils.ColorPrinter import ColorPrinter
+from BuildUtils import get_toolchain_fingerprint, get_num_cpus
 from SCons.Script.SConscript import Configure
 from SCons.Environment import Environment
 import os
@@ -29,6 +30,11 @@ import re
 import sys
 import itertools
 import copy
+import fnmatch
+import json
+import hashlib
+import threading
+import collections
 from multiprocessing import TimeoutError
 from multiprocessing.pool import ThreadPool
 
@@ -133,7 +139,195 @@ def getKey(rootTree, keystr, value):
             pass
 
 
+# environment variables a finder records so a cached result can be replayed
+# without searching again
+CACHED_ENV_VARS = ['CPPPATH', 'LIBPATH', 'LIBS', 'LIB',
+                   'CCFLAGS', 'LINKFLAGS', 'CPPDEFINES']
+
+_cache_lock = threading.Lock()
+
+
+def _envValues(env, var):
+    values = env.get(var, [])
+    if isinstance(values, str):
+        values = [values]
+    # keep define pairs as lists, everything else (including nodes) is stored
+    # as its string form
+    return [list(value) if isinstance(value, (list, tuple)) else str(value)
+            for value in values]
+
+
+def _envAdditions(base_env, env):
+    """
+    The CACHED_ENV_VARS values env has on top of base_env.
+    """
+    additions = {}
+    for var in CACHED_ENV_VARS:
+        base_values = _envValues(base_env, var) if base_env else []
+        added = [value for value in _envValues(env, var)
+                 if value not in base_values]
+        if added:
+            additions[var] = added
+    return additions
+
+
+def _envSequence(value):
+    return isinstance(value, (list, tuple, collections.deque, collections.UserList))
+
+
+def _envItems(value):
+    if isinstance(value, str):
+        return value.split()
+    return list(value)
+
+
+def _envMerge(env, base_env, search_env):
+    """
+    Merge into env every variable search_env, a clone of base_env, changed:
+    the values added to lists are appended and any other change replaces
+    the value, so what MergeFlags and ParseConfig added is kept.
+    """
+    base_values = base_env.Dictionary()
+    for var, value in search_env.Dictionary().items():
+        base_value = base_values.get(var, [])
+        if var in base_values and base_value == value:
+            continue
+        if _envSequence(base_value) or _envSequence(value):
+            base_items = _envItems(base_value)
+            added = [item for item in _envItems(value) if item not in base_items]
+            if added:
+                env.Append(**{var: added})
+        else:
+            env.Replace(**{var: value})
+
+
+# directories never worth descending into when looking for packages. Plain
+# names match any directory of that name, patterns with a slash match the end
+# of the path relative to the search root, absolute patterns match the path.
+DEFAULT_SKIP_DIRS = ['.git', '.svn', '.hg', 'node_modules', '__pycache__',
+                     'share/doc', 'share/man', 'share/locale',
+                     '/proc', '/sys', '/dev']
+
+
+class FileIndex(object):
+    """
+    Index of the files under a directory tree by basename, shared by every
+    finder searching the same root. The tree is scanned top-down with
+    os.scandir, one directory at a time and only as far as lookups need it.
+    """
+
+    def __init__(self, root, max_depth=None, skip_dirs=DEFAULT_SKIP_DIRS):
+        self.root = root
+        self.max_depth = max_depth
+        self.skip_dirs = skip_dirs
+        self.files = []
+        self.by_name = {}
+        self.pending = [(root, 0)]
+        self.lock = threading.Lock()
+
+    def skipDir(self, path, name):
+        relpath = os.path.relpath(path, self.root).replace(os.sep, '/')
+        for pattern in self.skip_dirs:
+            if pattern.startswith('/'):
+                if fnmatch.fnmatch(path.replace(os.sep, '/'), pattern):
+                    return True
+            elif '/' in pattern:
+                if fnmatch.fnmatch(relpath, pattern) or fnmatch.fnmatch(relpath, '*/' + pattern):
+                    return True
+            elif fnmatch.fnmatch(name, pattern):
+                return True
+        return False
+
+    def scanNext(self):
+        """
+        Index the files of the next pending directory. Must hold self.lock.
+        """
+        dirpath, depth = self.pending.pop()
+        subdirs = []
+        try:
+            with os.scandir(dirpath) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        if ((self.max_depth is None or depth < self.max_depth)
+                                and not self.skipDir(entry.path, entry.name)):
+                            subdirs.append((entry.path, depth + 1))
+                    else:
+                        self.by_name.setdefault(
+                            entry.name, []).append(len(self.files))
+                        self.files.append((dirpath, entry.name))
+        except OSError:
+            pass
+        self.pending.extend(reversed(subdirs))
+
+    def lookup(self, match, parent=None, cancelled=None):
+        """
+        Generate the (dir, name) pairs of the files in scan order. match is
+        either a list of basenames or a function called with a basename. If
+        parent is given only files in a directory with that name are
+        returned. Files already indexed are found by name, the rest of the
+        tree is only scanned while the caller keeps asking for more matches
+        and cancelled() is not true.
+        """
+        if callable(match):
+            matches = match
+        else:
+            matches = set(match).__contains__
+
+        with self.lock:
+            scanned = len(self.files)
+            positions = sorted(itertools.chain.from_iterable(
+                self.by_name[name] for name in self.by_name if matches(name)))
+
+        for position in positions:
+            dirpath, name = self.files[position]
+            if parent is None or os.path.basename(dirpath) == parent:
+                yield dirpath, name
+
+        while True:
+            with self.lock:
+                if scanned == len(self.files):
+                    if not self.pending or (cancelled and cancelled()):
+                        return
+                    self.scanNext()
+                new_files = self.files[scanned:]
+                scanned = len(self.files)
+
+            for dirpath, name in new_files:
+                if matches(name) and (parent is None or os.path.basename(dirpath) == parent):
+                    yield dirpath, name
+
+
+_file_indexes = {}
+_file_index_lock = threading.Lock()
+
+
+def GetFileIndex(root, max_depth=None, skip_dirs=DEFAULT_SKIP_DIRS):
+    """
+    Get the shared FileIndex for root, creating it the first time the root is
+    searched during this configure.
+    """
+    root = os.path.normpath(root)
+    key = (root, max_depth, tuple(skip_dirs))
+    with _file_index_lock:
+        if key not in _file_indexes:
+            _file_indexes[key] = FileIndex(root, max_depth, skip_dirs)
+        return _file_indexes[key]
+
+
 class PackageFinder(object):
+
+    # basenames of the files checkHeader and checkVersion look for, the name
+    # of the directory they must be in if any, and substrings of the library
+    # file names checkLib looks for
+    header_names = []
+    version_names = []
+    header_parent = None
+    lib_names = []
+
+    # SCons environments, nodes and Configure contexts aren't thread safe,
+    # finders searching in parallel take turns using them
+    scons_lock = threading.RLock()
+
     def __init__(self, env, paths, required, timeout, conf_dir):
 
         self.env = env
@@ -144,7 +338,13 @@ class PackageFinder(object):
         self.p = ColorPrinter()
         self.version = ""
         self.timedout = {'timedout': False}
+        self.deadline = None
         self.addPlatformPaths()
+        self.max_depth = None
+        self.skip_dirs = DEFAULT_SKIP_DIRS
+        if env:
+            self.max_depth = env.get('FINDPACKAGE_MAX_DEPTH', None)
+            self.skip_dirs = env.get('FINDPACKAGE_SKIP_DIRS', DEFAULT_SKIP_DIRS)
         if not conf_dir:
             self.conf_dir = 'confdir'
         else:
@@ -153,39 +353,76 @@ class PackageFinder(object):
 
     def startSearch(self):
         if self.timeout:
+            self.deadline = time.time() + self.timeout
             pool = ThreadPool(processes=1)
             async_result = pool.apply_async(
                 self.searchThread)
             try:
-                return async_result.get(timeout)
+                return async_result.get(self.timeout)
             except TimeoutError:
                 self.timedout['timedout'] = True
                 async_result.get()
                 if self.required:
-                    self.p.ErrorPrint("Timedout after " + str(timeout) +
+                    self.p.ErrorPrint("Timedout after " + str(self.timeout) +
                                       " seconds searching for " + self.packagename)
                 else:
-                    self.p.InfoPrint(" Timedout after " + str(timeout) +
+                    self.p.InfoPrint(" Timedout after " + str(self.timeout) +
                                      " seconds searching for " + self.packagename)
                 return None
+            finally:
+                pool.close()
         else:
             return self.searchThread()
 
+    def cancelled(self):
+        return self.timedout['timedout']
+
+    def lookupFiles(self, root, match, parent=None):
+        index = GetFileIndex(root, self.max_depth, self.skip_dirs)
+        return index.lookup(match, parent, self.cancelled)
+
+    def lockScons(self):
+        """
+        Wait for the SCons lock, giving up when the search times out first.
+        Returns if the lock was taken.
+        """
+        if self.deadline is None:
+            return PackageFinder.scons_lock.acquire()
+        remaining = self.deadline - time.time()
+        if remaining > 0 and PackageFinder.scons_lock.acquire(timeout=remaining):
+            if not self.cancelled() and time.time() < self.deadline:
+                return True
+            PackageFinder.scons_lock.release()
+        self.timedout['timedout'] = True
+        return False
+
+    def tryCompileTest(self, env):
+        # SCons only allows one Configure context at a time, so finders
+        # searching in parallel take turns running their link test
+        if not self.lockScons():
+            return False
+        try:
+            return self.compileTest(env)
+        finally:
+            PackageFinder.scons_lock.release()
+
     def getTestEnv(self):
-        if self.env is None:
-            test_env = Environment()
-        else:
-            test_env = self.env.Clone()
+        with PackageFinder.scons_lock:
+            if self.env is None:
+                test_env = Environment()
+            else:
+                test_env = self.env.Clone()
         return test_env
 
     def tryPackageConfig(self):
         try:
             if any(os.access(os.path.join(path, 'pkg-config'), os.X_OK) for path in os.environ["PATH"].split(os.pathsep)):
                 test_env = self.getTestEnv()
-                pkgconfig_str = 'pkg-config ' + self.packagename + " --cflags --libs"
+                pkgconfig_flags = subprocess.check_output(
+                    ['pkg-config', self.packagename, "--cflags", "--libs"]).decode('utf8').strip()
 
-                test_env.ParseConfig(pkgconfig_str)
-                if self.compileTest(test_env):
+                test_env.MergeFlags(pkgconfig_flags)
+                if self.tryCompileTest(test_env):
 
                     header_dirs = subprocess.check_output(
                         ['pkg-config', self.packagename, "--cflags"]).decode('utf8').strip().split(' ')
@@ -194,16 +431,13 @@ class PackageFinder(object):
                     for path in header_dirs:
                         if path.startswith('-I'):
                             path = path[2:]
-                            for root, dirs, files in os.walk(path, topdown=False):
-                                for name in files:
-                                    if self.timedout['timedout']:
-                                        return
-                                    version_file = self.checkVersion(
-                                        test_env, name, root)
-                                    if version_file:
-                                        found_version = version_file
-                                        break
-                                if found_version:
+                            for root, name in self.lookupFiles(path, self.version_names, self.header_parent):
+                                if self.timedout['timedout']:
+                                    return
+                                version_file = self.checkVersion(
+                                    test_env, name, root)
+                                if version_file:
+                                    found_version = version_file
                                     break
 
                         if found_version:
@@ -214,20 +448,112 @@ class PackageFinder(object):
                     else:
                         self.p.InfoPrint(
                             " Found " + self.packagename + " with unknown version.")
-                    if self.env:
-                        self.env.ParseConfig(pkgconfig_str)
-                    return test_env
-        except OSError:
+
+                    found_files = []
+                    if found_version:
+                        found_files.append(found_version)
+                    pc_dir = subprocess.check_output(
+                        ['pkg-config', self.packagename, "--variable=pcfiledir"]).decode('utf8').strip()
+                    found_files.append(os.path.join(
+                        pc_dir, self.packagename + '.pc'))
+
+                    return self.makeEntry(test_env, 'pkgconfig', None, None, found_version,
+                                          found_files, pkgconfig_flags)
+        except (OSError, subprocess.CalledProcessError):
             pass
 
-        return self.getTestEnv()
+    def cacheFile(self):
+        return os.path.join(self.conf_dir, 'findpackages_cache.json')
+
+    def cacheKey(self):
+        """
+        Hash of everything the search result depends on besides the found
+        files themselves: the search paths and the compiler and flags used
+        for the link test.
+        """
+        key = hashlib.sha1()
+        key.update(json.dumps([
+            self.packagename,
+            self.user_paths,
+            self.sys_paths,
+            sys.platform,
+            os.environ.get('PATH'),
+            os.environ.get('PKG_CONFIG_PATH')]).encode('utf8'))
+        test_env = self.getTestEnv()
+        with PackageFinder.scons_lock:
+            key.update(get_toolchain_fingerprint(
+                test_env,
+                ['CCFLAGS', 'CFLAGS', 'CPPFLAGS', 'CPPDEFINES', 'CPPPATH',
+                 'LINKFLAGS', 'LIBPATH', 'LIBS']).encode('utf8'))
+        return key.hexdigest()
+
+    def loadCache(self, key):
+        try:
+            with open(self.cacheFile()) as f:
+                entry = json.load(f).get(self.packagename)
+        except (IOError, ValueError):
+            return None
+
+        if not entry or entry['key'] != key:
+            return None
+        for path, mtime in entry['files'].items():
+            try:
+                if os.path.getmtime(path) != mtime:
+                    return None
+            except OSError:
+                return None
+        return entry
+
+    def saveCache(self, key, entry):
+        entry['key'] = key
+        with _cache_lock:
+            try:
+                with open(self.cacheFile()) as f:
+                    cache = json.load(f)
+            except (IOError, ValueError):
+                cache = {}
+            cache[self.packagename] = entry
+
+            if not os.path.isdir(self.conf_dir):
+                os.makedirs(self.conf_dir)
+            temp_file = self.cacheFile() + '.tmp'
+            with open(temp_file, 'w') as f:
+                json.dump(cache, f, indent=2)
+            os.replace(temp_file, self.cacheFile())
+
+    def makeEntry(self, test_env, method, found_headers, found_libs, found_version, found_files, flags=None):
+        """
+        Record what a successful search found, so it can be applied now and
+        replayed from the cache on later runs.
+        """
+        return {
+            'method': method,
+            'headers': found_headers,
+            'libs': found_libs,
+            'version': self.version,
+            'version_file': found_version,
+            'flags': flags,
+            'env': _envAdditions(self.getTestEnv(), test_env),
+            'files': dict((path, os.path.getmtime(path)) for path in found_files
+                          if os.path.exists(path)),
+        }
+
+    def applyEntry(self, entry):
+        test_env = self.getTestEnv()
+        test_env.Append(**entry['env'])
+        if entry['method'] == 'pkgconfig':
+            if self.env:
+                self.env.MergeFlags(entry['flags'])
+            return test_env
+        return self.foundPackage(test_env, entry['libs'], entry['headers'], entry['version_file'])
 
     def addPlatformPaths(self):
         test_env = self.getTestEnv()
 
         # check parent directory of the current project
-        self.sys_paths.append(os.path.abspath(
-            test_env.Dir('.').abspath + '/..'))
+        with PackageFinder.scons_lock:
+            project_dir = test_env.Dir('.').abspath
+        self.sys_paths.append(os.path.abspath(project_dir + '/..'))
 
         if sys.platform == 'win32':
             if not IsCrossCompile(test_env):
@@ -260,67 +586,56 @@ class PackageFinder(object):
         found_headers = None
         found_libs = None
         found_version = None
+        found_files = {}
         test_env = self.getTestEnv()
 
         for test_path in paths:
+            if not test_path:
+                continue
             self.p.InfoPrint(" Looking in " + str(test_path))
 
-            # include and lib paths passed separately
+            # include and lib paths passed separately, or look in same dir for
+            # lib and include
             if type(test_path) is list:
-                for root, dirs, files in os.walk(test_path[0], topdown=False):
-                    for name in files:
-                        if self.timedout['timedout']:
-                            return
-                        header_dir = self.checkHeader(test_env, name, root)
-                        if header_dir:
-                            found_headers = header_dir
-                            break
-                    if found_headers:
-                        break
-
-                for root, dirs, files in os.walk(test_path[1], topdown=False):
-                    for name in files:
-                        if self.timedout['timedout']:
-                            return
-                        lib_dir = self.checkLib(test_env, name, root)
-                        if lib_dir:
-                            found_libs = lib_dir
-                            break
-                    if found_libs:
-                        break
-            # look in same dir for lib and include
+                header_path, lib_path = test_path
             else:
-                for root, dirs, files in os.walk(test_path, topdown=False):
-                    for name in files:
-                        if self.timedout['timedout']:
-                            return
-                        header_dir = self.checkHeader(test_env, name, root)
-                        if header_dir:
-                            found_headers = header_dir
-                            break
-                        lib_dir = self.checkLib(test_env, name, root)
-                        if lib_dir:
-                            found_libs = lib_dir
-                            break
-                    if found_headers and found_libs:
-                        break
+                header_path = lib_path = test_path
+
+            for root, name in self.lookupFiles(header_path, self.header_names, self.header_parent):
+                if self.timedout['timedout']:
+                    return
+                header_dir = self.checkHeader(test_env, name, root)
+                if header_dir:
+                    found_headers = header_dir
+                    found_files['header'] = os.path.join(root, name)
+                    break
+
+            for root, name in self.lookupFiles(lib_path, self.isLibCandidate):
+                if self.timedout['timedout']:
+                    return
+                lib_dir = self.checkLib(test_env, name, root)
+                if lib_dir:
+                    found_libs = lib_dir
+                    found_files['lib'] = os.path.join(root, name)
+                    break
 
             if found_headers and found_libs:
-                for root, dirs, files in os.walk(found_headers, topdown=False):
-                    for name in files:
-                        if self.timedout['timedout']:
-                            return
-                        version_file = self.checkVersion(test_env, name, root)
-                        if version_file:
-                            found_version = version_file
-                            break
-                    if found_version:
+                for root, name in self.lookupFiles(found_headers, self.version_names, self.header_parent):
+                    if self.timedout['timedout']:
+                        return
+                    version_file = self.checkVersion(test_env, name, root)
+                    if version_file:
+                        found_version = version_file
+                        found_files['version'] = version_file
                         break
 
-                if self.compileTest(test_env):
+                if self.tryCompileTest(test_env):
                     self.p.InfoPrint(" Found " + self.packagename + " version " + self.version +
                                      " in " + str(found_headers))
-                    return self.foundPackage(test_env, found_libs, found_headers, found_version)
+                    return self.makeEntry(test_env, 'search', found_headers, found_libs,
+                                          found_version, list(found_files.values()))
+                elif self.timedout['timedout']:
+                    return
                 else:
                     self.p.InfoPrint(" Candidate failed in " +
                                      found_headers + " and " + found_libs)
@@ -328,34 +643,48 @@ class PackageFinder(object):
                     found_libs = None
                     found_headers = None
                     found_version = None
+                    found_files = {}
             else:
                 test_env = self.getTestEnv()
                 found_libs = None
                 found_headers = None
-                found_freetype_version = None
+                found_version = None
+                found_files = {}
+
+    def isLibCandidate(self, name):
+        return any(lib_name in name for lib_name in self.lib_names)
 
     def searchThread(self):
 
+        cache_key = self.cacheKey()
+        entry = self.loadCache(cache_key)
+        if entry:
+            self.version = entry['version']
+            self.p.InfoPrint(" Found " + self.packagename + " version " + self.version +
+                             " in " + str(entry['headers']) + " (cached)")
+            return self.applyEntry(entry)
+
         self.p.InfoPrint(" Searching for " + self.packagename + "...")
         # first search user paths
-        result = self.search(self.user_paths, required=self.required)
-        if result:
-            return result
+        entry = self.search(self.user_paths, required=self.required)
         if self.timedout['timedout']:
             return
 
         # next try package config
-        if 'linux' in sys.platform:
-            result = self.tryPackageConfig()
-            if result:
-                return result
+        if not entry and 'linux' in sys.platform:
+            entry = self.tryPackageConfig()
             if self.timedout['timedout']:
                 return
 
         # finally try system paths
-        result = self.search(self.sys_paths, required=self.required)
-        if result:
-            return result
+        if not entry:
+            entry = self.search(self.sys_paths, required=self.required)
+            if self.timedout['timedout']:
+                return
+
+        if entry:
+            self.saveCache(cache_key, entry)
+            return self.applyEntry(entry)
         if self.required:
             self.p.ErrorPrint("Failed to find working " +
                               self.packagename + " package.")
@@ -366,6 +695,12 @@ class PackageFinder(object):
 def FindGraphite2(env=None, paths=[], required=False, timeout=None, conf_dir=None):
 
     class Graphite2Finder(PackageFinder):
+
+        header_names = ['Font.h']
+        version_names = ['Font.h']
+        header_parent = 'graphite2'
+        lib_names = ['graphite2']
+
         def __init__(self, env, paths, required, timeout, conf_dir):
             super(Graphite2Finder, self).__init__(
                 env, paths, required, timeout, conf_dir)
@@ -444,6 +779,11 @@ def FindGraphite2(env=None, paths=[], required=False, timeout=None, conf_dir=Non
 
 def FindGlib(env=None, paths=[], required=False, timeout=None, conf_dir=None):
     class GlibFinder(PackageFinder):
+
+        header_names = ['glib.h', 'glibconfig.h']
+        version_names = ['glibconfig.h']
+        lib_names = ['glib-2.0']
+
         def __init__(self, env, paths, required, timeout, conf_dir):
             super(GlibFinder, self).__init__(
                 env, paths, required, timeout, conf_dir)
@@ -491,16 +831,10 @@ def FindGlib(env=None, paths=[], required=False, timeout=None, conf_dir=None):
                 and (file.startswith(env["SHLIBPREFIX"]) or file.startswith(env["LIBPREFIX"]))
                     and (file.endswith(env["SHLIBSUFFIX"]) or file.endswith(env["SHLIBSUFFIX"]))):
                 env.Append(LIBPATH=[root])
-                found_headers = False
-                for configroot, dirs, files in os.walk(root, topdown=False):
-                    for name in files:
-                        if self.timedout['timedout']:
-                            return
-                        header_dir = self.checkHeader(env, name, configroot)
-                        if header_dir:
-                            found_headers = header_dir
-                            break
-                    if found_headers:
+                for configroot, name in self.lookupFiles(root, self.header_names):
+                    if self.timedout['timedout']:
+                        return
+                    if self.checkHeader(env, name, configroot):
                         break
                 return root
 
@@ -539,6 +873,12 @@ def FindGlib(env=None, paths=[], required=False, timeout=None, conf_dir=None):
 
 def FindIcu(env=None, paths=[], required=False, timeout=None, conf_dir=None):
     class IcuFinder(PackageFinder):
+
+        header_names = ['ucnv.h']
+        version_names = ['uvernum.h']
+        header_parent = 'unicode'
+        lib_names = ['icuuc', 'icudata']
+
         def __init__(self, env, paths, required, timeout, conf_dir):
             super(IcuFinder, self).__init__(
                 env, paths, required, timeout, conf_dir)
@@ -626,6 +966,11 @@ def FindIcu(env=None, paths=[], required=False, timeout=None, conf_dir=None):
 
 def FindFreetype(env=None, paths=[], required=False, timeout=None, conf_dir=None):
     class FreetypeFinder(PackageFinder):
+
+        header_names = ['ft2build.h']
+        version_names = ['freetype.h']
+        lib_names = ['freetype']
+
         def __init__(self, env, paths, required, timeout, conf_dir):
             super(FreetypeFinder, self).__init__(
                 env, paths, required, timeout, conf_dir)
@@ -722,6 +1067,11 @@ def FindFreetype(env=None, paths=[], required=False, timeout=None, conf_dir=None
 
 def FindCairo(env=None, paths=[], required=False, timeout=None, conf_dir=None):
     class CairoFinder(PackageFinder):
+
+        header_names = ['cairo.h']
+        version_names = ['cairo-version.h']
+        lib_names = ['cairo']
+
         def __init__(self, env, paths, required, timeout, conf_dir):
             super(CairoFinder, self).__init__(
                 env, paths, required, timeout, conf_dir)
@@ -795,3 +1145,63 @@ def FindCairo(env=None, paths=[], required=False, timeout=None, conf_dir=None):
 
     finder = CairoFinder(env, paths, required, timeout, conf_dir)
     return finder.startSearch()
+
+
+PACKAGE_FINDERS = {
+    'graphite2': FindGraphite2,
+    'glib': FindGlib,
+    'icu': FindIcu,
+    'freetype': FindFreetype,
+    'cairo': FindCairo,
+}
+
+
+def FindPackages(packages, env=None, paths=[], required=False, timeout=None, conf_dir=None, jobs=None):
+    """
+    Search for several packages at the same time on a pool of worker threads.
+    packages is a list of Find* functions or PACKAGE_FINDERS names. Each
+    package is searched with its own clone of env, and what was found is
+    merged into env in the order the packages were given. timeout is one
+    deadline for the whole search. Returns the result of each Find* call in
+    the same order.
+    """
+    finders = [PACKAGE_FINDERS.get(package, package) for package in packages]
+    if not finders:
+        return []
+    if timeout:
+        deadline = time.time() + timeout
+    # cloned up front, env is only used from this thread
+    base_env = env.Clone() if env else None
+    search_envs = [env.Clone() if env else None for _ in finders]
+
+    def find(search):
+        finder, search_env = search
+        search_timeout = None
+        if timeout:
+            search_timeout = deadline - time.time()
+            if search_timeout <= 0:
+                message = "Timedout after " + str(timeout) + \
+                    " seconds before searching with " + finder.__name__
+                if required:
+                    ColorPrinter().ErrorPrint(message)
+                else:
+                    ColorPrinter().InfoPrint(" " + message)
+                return None, None
+        result = finder(search_env, list(paths), required,
+                        search_timeout, conf_dir)
+        return result, search_env
+
+    pool = ThreadPool(processes=min(len(finders), jobs or get_num_cpus()))
+    try:
+        searches = pool.map(find, list(zip(finders, search_envs)))
+    finally:
+        pool.close()
+        pool.join()
+
+    results = []
+    for result, search_env in searches:
+        if env and result:
+            _envMerge(env, base_env, search_env)
+            result = env
+        results.append(result)
+    return results
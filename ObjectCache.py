@@ -0,0 +1,214 @@
+# This file is licensed under the MIT License.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+"""
+Content addressed cache of compiled objects shared between builds.
+"""
+
+# python
+import os
+import json
+import time
+import shutil
+import hashlib
+import tempfile
+import threading
+import subprocess
+
+# BuildUtils
+from BuildUtils import get_cache_dir, get_toolchain_fingerprint
+from BuildUtils.ColorPrinter import ColorPrinter
+
+# largest the cache may grow before the least recently used objects are
+# removed, override with $BUILDUTILS_OBJECT_CACHE_SIZE in MB
+DEFAULT_CACHE_SIZE_MB = 5 * 1024
+
+# commands writing the preprocessed source to stdout, by shared and language
+PREPROCESS_COMMANDS = {
+    (False, 'c'): '$CC -E $CFLAGS $CCFLAGS $_CCCOMCOM $SOURCES',
+    (False, 'c++'): '$CXX -E $CXXFLAGS $CCFLAGS $_CCCOMCOM $SOURCES',
+    (True, 'c'): '$SHCC -E $SHCFLAGS $SHCCFLAGS $_CCCOMCOM $SOURCES',
+    (True, 'c++'): '$SHCXX -E $SHCXXFLAGS $SHCCFLAGS $_CCCOMCOM $SOURCES',
+}
+
+
+class ObjectCache(object):
+    """
+    Objects and their compile logs stored by a hash of the preprocessed
+    source, compile command and toolchain.
+    """
+
+    def __init__(self, cache_dir, max_size):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.saved_time = 0.0
+        self.stored = False
+
+    def objectPath(self, key):
+        return os.path.join(self.cache_dir, key[:2], key)
+
+    def Key(self, env, command, target, source, shared):
+        """
+        Hash the preprocessed source with the compile command, returns None
+        and reports why if the source can't be preprocessed. The project dir is taken out of
+        the line markers so checkouts in other dirs share keys, objects with
+        debug info then keep the paths of the checkout that compiled them
+        unless it is mapped away with -fdebug-prefix-map.
+        """
+        if os.path.splitext(str(source[0]))[1] == '.c':
+            language = 'c'
+        else:
+            language = 'c++'
+        # without the target # paths aren't resolved
+        preprocess = env.subst(PREPROCESS_COMMANDS[(shared, language)],
+                               0, target, source)
+        process_env = dict((key, str(value))
+                           for key, value in env['ENV'].items())
+        key = hashlib.sha1()
+        key.update(get_toolchain_fingerprint(env).encode('utf8'))
+        key.update(command.encode('utf8'))
+        errors = tempfile.TemporaryFile()
+        try:
+            proc = subprocess.Popen(preprocess, shell=True, env=process_env,
+                                    stdout=subprocess.PIPE,
+                                    stderr=errors)
+        except OSError as error:
+            errors.close()
+            self.reportUncached(source, str(error))
+            return None
+        project_dir = env.get('PROJECT_DIR', env.Dir('#').abspath)
+        # the paths are escaped in the line markers on windows
+        project_dirs = [path.encode('utf8') for path in
+                        set([project_dir, project_dir.replace('\\', '\\\\')])]
+        for line in proc.stdout:
+            if line.startswith(b'#'):
+                for path in project_dirs:
+                    line = line.replace(path, b'.')
+            key.update(line)
+        proc.stdout.close()
+        if proc.wait():
+            errors.seek(0)
+            self.reportUncached(source, errors.read().decode('utf8', 'replace'))
+            errors.close()
+            return None
+        errors.close()
+        return key.hexdigest()
+
+    def reportUncached(self, source, error):
+        lines = error.strip().splitlines()[:10]
+        ColorPrinter().InfoPrint(" Object cache can't preprocess " + str(source[0]) +
+                                 ", compiling it uncached" +
+                                 ''.join('\n    ' + line for line in lines))
+
+    def Restore(self, key, target, log_file):
+        """
+        Copy a cached object and its compile log into place, returns if the
+        object was in the cache.
+        """
+        path = self.objectPath(key)
+        try:
+            with open(path + '.json') as f:
+                meta = json.load(f)
+            shutil.copyfile(path + '.obj', target)
+            shutil.copyfile(path + '.log', log_file)
+        except (IOError, OSError, ValueError):
+            return False
+        # the modification time orders the entries for eviction
+        now = time.time()
+        for suffix in ['.obj', '.log', '.json']:
+            try:
+                os.utime(path + suffix, (now, now))
+            except OSError:
+                pass
+        with self.lock:
+            self.hits += 1
+            self.saved_time += meta.get('duration', 0.0)
+        return True
+
+    def Store(self, key, target, log_file, duration):
+        """
+        Add a freshly compiled object and its compile log to the cache.
+        """
+        path = self.objectPath(key)
+        if not os.path.isdir(os.path.dirname(path)):
+            try:
+                os.makedirs(os.path.dirname(path))
+            except OSError:
+                pass
+        try:
+            for source, suffix in [(target, '.obj'), (log_file, '.log')]:
+                fd, temp_file = tempfile.mkstemp(dir=os.path.dirname(path))
+                os.close(fd)
+                if os.path.exists(source):
+                    shutil.copyfile(source, temp_file)
+                os.replace(temp_file, path + suffix)
+            # written last so a partly stored entry is never restored
+            fd, temp_file = tempfile.mkstemp(dir=os.path.dirname(path))
+            with os.fdopen(fd, 'w') as f:
+                json.dump({'duration': duration, 'time': time.time()}, f)
+            os.replace(temp_file, path + '.json')
+        except (IOError, OSError):
+            return
+        with self.lock:
+            self.stored = True
+
+    def Miss(self):
+        with self.lock:
+            self.misses += 1
+
+    def Trim(self):
+        """
+        Remove the least recently used entries until the cache fits in its
+        maximum size.
+        """
+        files = []
+        total = 0
+        for root, _unused_dirs, names in os.walk(self.cache_dir):
+            for name in names:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                files.append((stat.st_mtime, path, stat.st_size))
+                total += stat.st_size
+        for _unused_mtime, path, size in sorted(files):
+            if total <= self.max_size:
+                break
+            try:
+                os.unlink(path)
+            except OSError:
+                continue
+            total -= size
+
+
+_object_cache = []
+
+
+def GetObjectCache():
+    """
+    Get the object cache shared by every target in this build.
+    """
+    if not _object_cache:
+        size_mb = int(os.environ.get(
+            'BUILDUTILS_OBJECT_CACHE_SIZE', DEFAULT_CACHE_SIZE_MB))
+        _object_cache.append(ObjectCache(
+            get_cache_dir('objects'), size_mb * 1024 * 1024))
+    return _object_cache[0]
+
+
+def ObjectCacheUsed():
+    return bool(_object_cache)
+
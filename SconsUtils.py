@@ -24,12 +24,23 @@ import platform
 import subprocess
 import re
 import sys
+import io
+import signal
+import hashlib
+import math
+import json
+import fnmatch
+import itertools
+import threading
+import collections
 import collections.abc
+from multiprocessing.pool import ThreadPool
 
 # scons
 from SCons.Script.SConscript import call_stack
 from SCons.Script.Main import Progress
 from SCons import Action
+import SCons.Tool
 from SCons.Defaults import Copy, mkdir_func, get_paths_str
 from SCons.Script import Main
 from SCons.Node import NodeList
@@ -41,13 +52,141 @@ from SCons.Action import ActionFactory
 
 
 from BuildUtils.ColorPrinter import ColorPrinter
+from BuildUtils.CpuInfo import CgroupPaths, GetCpuInfo, ReadFirstLine
+from BuildUtils.ObjectCache import GetObjectCache, ObjectCacheUsed
 from BuildUtils import get_num_cpus
 
 Mkdir = ActionFactory(mkdir_func,
                       lambda dir: ColorPrinter().InfoPrint(' Mkdir(%s)' % get_paths_str(dir)))
 
 
-def SetBuildJobs(env):
+# memory assumed per compile job when no build has recorded any yet
+DEFAULT_JOB_MEMORY_MB = 1024
+
+# where display_build_status keeps statistics of the jobs the last build ran
+JOB_STATS_FILE = 'build/job_stats.json'
+
+
+def _available_memory_mb():
+    """
+    Get the memory available for the build in MB, within any cgroup memory
+    limit, or None when it can't be found.
+    """
+    available = None
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    available = int(line.split()[1]) // 1024
+                    break
+    except (IOError, OSError):
+        pass
+    for path in CgroupPaths('memory'):
+        limit = ReadFirstLine(path + '/memory.max') or \
+            ReadFirstLine(path + '/memory.limit_in_bytes')
+        if not limit:
+            continue
+        usage = ReadFirstLine(path + '/memory.current') or \
+            ReadFirstLine(path + '/memory.usage_in_bytes') or '0'
+        # v1 reports no limit as a huge number
+        if limit != 'max' and int(limit) < 1 << 60:
+            cgroup_available = (int(limit) - int(usage)) // (1024 * 1024)
+            if available is None or cgroup_available < available:
+                available = cgroup_available
+        break
+    return available
+
+
+def _read_job_stats(env):
+    """
+    Get the job statistics recorded by the last build.
+    """
+    stats_file = env.get('PROJECT_DIR', env.Dir('.').abspath) + \
+        '/' + JOB_STATS_FILE
+    try:
+        with open(stats_file) as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return {}
+
+
+def _last_build_load(stats):
+    """
+    Get how much of the 1 minute load average is still the last build's own
+    jobs, which fade from it by e every minute after the build ends.
+    """
+    if not stats.get('num_jobs') or not stats.get('time'):
+        return 0.0
+    elapsed = max(0.0, time.time() - stats['time'])
+    return stats['num_jobs'] * math.exp(-elapsed / 60.0)
+
+
+def _write_job_stats(project_dir, entries, num_jobs):
+    """
+    Save the 90th percentile peak memory of the build's compile jobs and
+    the number of parallel jobs it ran for SetBuildJobs to size the next
+    build with.
+    """
+    peaks = sorted(entry['peak_rss_kb'] for entry in entries
+                   if entry['kind'] == 'compile' and entry.get('peak_rss_kb'))
+    if not peaks:
+        return
+    stats = {
+        'job_memory_mb': peaks[int(0.9 * (len(peaks) - 1))] // 1024 + 1,
+        'jobs': len(peaks),
+        'num_jobs': num_jobs,
+        'time': time.time(),
+    }
+    stats_file = project_dir + '/' + JOB_STATS_FILE
+    if not os.path.isdir(os.path.dirname(stats_file)):
+        os.makedirs(os.path.dirname(stats_file))
+    with open(stats_file, 'w') as f:
+        json.dump(stats, f)
+
+
+def select_num_jobs(env, job_memory_mb=None):
+    """
+    Pick the number of parallel jobs for a build, returns the number and
+    why it was chosen.
+    """
+    cpus = get_num_cpus()
+    jobs = cpus
+    reason = "%d usable CPUs" % cpus
+    stats = _read_job_stats(env)
+
+    memory_source = "configured"
+    if not job_memory_mb:
+        job_memory_mb = stats.get('job_memory_mb')
+        memory_source = "learned"
+    if not job_memory_mb:
+        job_memory_mb = DEFAULT_JOB_MEMORY_MB
+        memory_source = "default"
+    available = _available_memory_mb()
+    if available is not None:
+        memory_jobs = max(1, available // job_memory_mb)
+        if memory_jobs < jobs:
+            jobs = memory_jobs
+            reason = "%d MB available memory / %d MB per job (%s)" % (
+                available, job_memory_mb, memory_source)
+
+    cpu_info = GetCpuInfo()
+    # the load average is host wide, under a cgroup quota it says nothing
+    # about the CPU time left to this build
+    if hasattr(os, 'getloadavg') and not cpu_info['cgroup_limit']:
+        host_load = os.getloadavg()[0]
+        load = max(0.0, host_load - _last_build_load(stats))
+        # the share of the load falling on the CPUs this process may use
+        load *= float(cpu_info['usable']) / cpu_info['logical']
+        load_jobs = max(1, int(cpus - load))
+        if load_jobs < jobs:
+            jobs = load_jobs
+            reason = "load average of %.2f (%.2f on the usable CPUs)" % (
+                host_load, load)
+
+    return jobs, reason
+
+
+def SetBuildJobs(env, job_memory_mb=None):
     ###################################################
     # Determine number of Jobs
     # start by assuming num_jobs was not set
@@ -71,9 +210,10 @@ def SetBuildJobs(env):
     # num_jobs wasn't specificed so let use the
     # max number since the user doesn't seem to care
     if not NUM_JOBS_SET:
-        NUM_CPUS = get_num_cpus()
-        ColorPrinter().InfoPrint(" Building with " + str(NUM_CPUS) + " parallel jobs")
-        env.SetOption("num_jobs", NUM_CPUS)
+        NUM_JOBS, reason = select_num_jobs(env, job_memory_mb)
+        ColorPrinter().InfoPrint(" Building with " + str(NUM_JOBS) +
+                                 " parallel jobs, limited by " + reason)
+        env.SetOption("num_jobs", NUM_JOBS)
     else:
         # user wants a certain number of jobs so do that
         ColorPrinter().InfoPrint(
@@ -123,7 +263,145 @@ def build_status():
     return (status, failures_message)
 
 
-def display_build_status(project_dir, start_time):
+def _log_has_info(filename, sourcefile):
+    with open(filename, "r") as f:
+        for line in f:
+            if(('error' in line or 'warning' in line or "note" in line) and not line.startswith(sourcefile)):
+                return True
+    return False
+
+
+def _write_log_summary(out, printer, filename, suffix, skip_single_line=False):
+    """
+    Write a build log with its errors, warnings and notes highlighted, if
+    it has any of them.
+    """
+    sourcefile = os.path.basename(filename).replace(suffix, "")
+    if not _log_has_info(filename, sourcefile):
+        return
+    if skip_single_line:
+        with open(filename, "r") as f:
+            if len(list(itertools.islice(f, 2))) == 1:
+                return
+
+    out.write(os.linesep + printer.OKBLUE + sourcefile +
+              ":" + printer.ENDC + os.linesep)
+    with open(filename, "r") as f:
+        for line in f:
+            line = line.rstrip("\r\n")
+            if(('error' in line or 'warning' in line or "note" in line) and not line.startswith(sourcefile)):
+                line = printer.highlight_word(line, "error", printer.FAIL)
+                line = printer.highlight_word(line, "warning", printer.WARNING)
+                line = printer.highlight_word(line, "note", printer.OKBLUE)
+            out.write(line + os.linesep)
+    out.write(os.linesep)
+
+
+def _buffered_stdout():
+    """
+    Open a large-buffered writer on stdout, SCons makes sys.stdout flush
+    on every write.
+    """
+    sys.stdout.flush()
+    try:
+        return io.open(sys.stdout.fileno(), 'w', buffering=1 << 16, closefd=False,
+                       encoding=getattr(sys.stdout, 'encoding', None) or 'utf8', errors='replace')
+    except (AttributeError, ValueError, io.UnsupportedOperation):
+        return sys.stdout
+
+
+def _write_slowest_report(out, printer, entries, slowest):
+    """
+    Write the slowest compile and link actions of the build.
+    """
+    entries = sorted(entries, key=lambda entry: entry['duration'], reverse=True)
+    if not entries or not slowest:
+        return
+    out.write(os.linesep + printer.OKBLUE + "Slowest actions:" +
+              printer.ENDC + os.linesep)
+    for entry in entries[:slowest]:
+        line = "  %8.3fs  %-7s %s" % (entry['duration'],
+                                      entry['kind'], entry['target'])
+        if entry.get('peak_rss_kb'):
+            line += "  (%.1f MB)" % (entry['peak_rss_kb'] / 1024.0)
+        out.write(line + os.linesep)
+    out.write(os.linesep)
+
+
+def critical_path(entries):
+    """
+    Find the longest chain of dependent actions in a build profile, returns
+    the chain's length in seconds and its entries in build order.
+    """
+    by_target = dict((entry['target'], entry) for entry in entries)
+    path_time = {}
+    path_prev = {}
+    for entry in sorted(entries, key=lambda entry: entry['end']):
+        prev = None
+        prev_time = 0.0
+        for dep in entry.get('deps', []):
+            if dep in path_time and path_time[dep] > prev_time:
+                prev = dep
+                prev_time = path_time[dep]
+        path_time[entry['target']] = prev_time + entry['duration']
+        path_prev[entry['target']] = prev
+    if not path_time:
+        return 0.0, []
+    target = max(path_time, key=path_time.get)
+    length = path_time[target]
+    path = []
+    while target is not None:
+        path.append(by_target[target])
+        target = path_prev[target]
+    return length, list(reversed(path))
+
+
+def _write_parallelism_report(out, printer, entries, jobs):
+    """
+    Write how well the build used its parallel jobs, its critical path and
+    how much faster it could get with more jobs.
+    """
+    if not entries:
+        return
+    wall = max(entry['end'] for entry in entries) - \
+        min(entry['start'] for entry in entries)
+    work = sum(entry['duration'] for entry in entries)
+    if wall <= 0:
+        return
+
+    running = 0
+    peak = 0
+    events = sorted([(entry['start'], 1) for entry in entries] +
+                    [(entry['end'], -1) for entry in entries])
+    for _, change in events:
+        running += change
+        peak = max(peak, running)
+
+    length, path = critical_path(entries)
+
+    out.write(printer.OKBLUE + "Parallelism:" + printer.ENDC + os.linesep)
+    out.write("  %d jobs, %.3fs of work in %.3fs" %
+              (jobs, work, wall) + os.linesep)
+    out.write("  average concurrency %.2f, peak %d" %
+              (work / wall, peak) + os.linesep)
+    idle = max(0.0, jobs * wall - work)
+    out.write("  idle core time %.3fs (%.1f%%)" %
+              (idle, idle / (jobs * wall) * 100.0) + os.linesep)
+    out.write("  critical path %.3fs through %d actions:" %
+              (length, len(path)) + os.linesep)
+    for entry in path:
+        out.write("    %8.3fs  %s" %
+                  (entry['duration'], entry['target']) + os.linesep)
+    for more_jobs in [jobs * 2, jobs * 4]:
+        bound = max(length, work / more_jobs)
+        out.write("  with %d jobs: at best %.3fs (%.2fx)" %
+                  (more_jobs, bound, wall / bound) + os.linesep)
+    out.write("  with unlimited jobs: at best %.3fs (%.2fx)" %
+              (length, wall / length if length else 1.0) + os.linesep)
+    out.write(os.linesep)
+
+
+def display_build_status(project_dir, start_time, slowest=10):
     """Display the build status.  Called by atexit.
     Here you could do all kinds of complicated things."""
     status, _unused_failures_message = build_status()
@@ -134,68 +412,55 @@ def display_build_status(project_dir, start_time):
     compile_logs = []
     link_logs = []
 
-    for root, dirs, files in os.walk(project_dir + '/build'):
-        for name in files:
-            if name.endswith('_compile.txt'):
-                compile_logs.append(os.path.join(root, name))
-            if name.endswith('_link.txt'):
-                link_logs.append(os.path.join(root, name))
-
+    # only logs written by this build with something in them
+    if _build_manifests:
+        for manifest in sorted(_build_manifests):
+            for entry in read_build_manifest(manifest, since=start_time):
+                if entry['size'] == 0:
+                    continue
+                if entry['kind'] == 'compile':
+                    compile_logs.append(entry['log'])
+                else:
+                    link_logs.append(entry['log'])
+            compact_build_manifest(manifest)
+    else:
+        for root, dirs, files in os.walk(project_dir + '/build'):
+            for name in files:
+                if name.endswith('_compile.txt') or name.endswith('_link.txt'):
+                    filename = os.path.join(root, name)
+                    stat = os.stat(filename)
+                    if stat.st_size == 0 or stat.st_mtime < start_time:
+                        continue
+                    if name.endswith('_compile.txt'):
+                        compile_logs.append(filename)
+                    else:
+                        link_logs.append(filename)
+
+    out = _buffered_stdout()
     for filename in compile_logs:
-        compileOutput = []
-        sourcefile = os.path.basename(filename).replace("_compile.txt", "")
-        f = open(filename, "r")
-
-        tempList = f.read().splitlines()
-        if tempList:
-            if("windows" in platform.system().lower() and len(tempList) == 1):
-                continue
-            compileOutput += [
-                printer.OKBLUE
-                + sourcefile
-                + ":"
-                + printer.ENDC
-            ]
-            compileOutput += tempList
-
-        pending_output = os.linesep
-        found_info = False
-
-        for line in compileOutput:
-            if(('error' in line or 'warning' in line or "note" in line) and not line.startswith(sourcefile)):
-                line = printer.highlight_word(line, "error", printer.FAIL)
-                line = printer.highlight_word(line, "warning", printer.WARNING)
-                line = printer.highlight_word(line, "note", printer.OKBLUE)
-                found_info = True
-            pending_output += line + os.linesep
-        if found_info:
-            print(pending_output)
-
+        _write_log_summary(out, printer, filename, "_compile.txt",
+                           skip_single_line="windows" in platform.system().lower())
     for filename in link_logs:
-        linkOutput = []
-        sourcefile = os.path.basename(filename).replace("_link.txt", "")
-        f = open(filename, "r")
-        tempList = f.read().splitlines()
-        if tempList:
-            linkOutput += [
-                printer.OKBLUE
-                + sourcefile
-                + ":"
-                + printer.ENDC
-            ]
-            linkOutput += tempList
-
-        pending_output = os.linesep
-        found_info = False
-        for line in linkOutput:
-            if(('error' in line or 'warning' in line or "note" in line) and not line.startswith(sourcefile)):
-                line = printer.highlight_word(line, "error", printer.FAIL)
-                line = printer.highlight_word(line, "warning", printer.WARNING)
-                line = printer.highlight_word(line, "note", printer.OKBLUE)
-                found_info = True
-            pending_output += line + os.linesep
-        if found_info:
-            print(pending_output)
+        _write_log_summary(out, printer, filename, "_link.txt")
+    profile_entries = []
+    for profile in sorted(_build_profiles):
+        profile_entries.extend(read_build_profile(profile))
+    for log_dir in set(os.path.dirname(profile) for profile in _build_profiles):
+        prune_build_profiles(log_dir)
+    _write_slowest_report(out, printer, profile_entries, slowest)
+    _write_parallelism_report(out, printer, profile_entries,
+                              GetOption('num_jobs') or 1)
+    _write_job_stats(project_dir, profile_entries, GetOption('num_jobs') or 1)
+    if ObjectCacheUsed():
+        cache = GetObjectCache()
+        lookups = cache.hits + cache.misses
+        if lookups:
+            out.write(printer.OKBLUE + "Object cache:" + printer.ENDC +
+                      " %d/%d hits (%.1f%%), saved %.3fs" % (cache.hits, lookups, cache.hits * 100.0 / lookups,
+                                                             cache.saved_time) + os.linesep + os.linesep)
+        if cache.stored:
+            cache.Trim()
+    out.flush()
 
     if status == 'failed':
         print(printer.FAIL + "Build failed" + printer.ENDC +
@@ -205,6 +470,638 @@ def display_build_status(project_dir, start_time):
               " in %.3f seconds" % (time.time() - start_time))
 
 
+# name of the file in build_logs listing every log written, one JSON
+# object per line
+BUILD_MANIFEST = 'manifest.jsonl'
+
+# the time of this build, naming its build log and profiles
+_build_log_time = []
+
+
+def build_log_time():
+    """
+    Get the time naming the logs and profiles of this build, the same for
+    every target set up in this run.
+    """
+    if not _build_log_time:
+        _build_log_time.append(datetime.datetime.fromtimestamp(
+            time.time()).strftime('%Y_%m_%d__%H_%M_%S'))
+    return _build_log_time[0]
+
+
+# build profiles kept in each build_logs dir, enough for the history
+# _compile_durations reads
+BUILD_PROFILE_KEEP = 10
+
+# the manifests and timing profiles SetupBuildEnv set up during this run
+_build_manifests = set()
+_build_profiles = set()
+_manifest_lock = threading.Lock()
+
+# resource usage of the commands spawned by the current job thread
+_spawn_usage = threading.local()
+
+
+def _wait4_spawn(sh, escape, cmd, args, env):
+    """
+    Spawn a command the way SCons does on posix, but reap it with wait4 so
+    the peak memory of the command can be recorded in the build profile.
+    """
+    proc = subprocess.Popen([sh, '-c', ' '.join(args)], env=env, close_fds=True)
+    pid, status, usage = os.wait4(proc.pid, 0)
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    peak_rss = usage.ru_maxrss
+    if sys.platform == 'darwin':
+        # macOS reports bytes, everything else kilobytes
+        peak_rss //= 1024
+    _spawn_usage.peak_rss = max(getattr(_spawn_usage, 'peak_rss', 0), peak_rss)
+    return proc.returncode
+
+
+def rusage_spawn(spawn):
+    """
+    Get the SPAWN to use in place of spawn so the peak memory of each
+    command is recorded. Only SCons' own posix spawn is replaced, a spawn
+    the caller set up is kept and its commands go without memory stats.
+    """
+    if getattr(spawn, '__module__', None) == 'SCons.Platform.posix':
+        return _wait4_spawn
+    return spawn
+
+
+def record_build_log(manifest, entry):
+    with _manifest_lock:
+        with open(manifest, 'a') as f:
+            f.write(json.dumps(entry) + '\n')
+
+
+def read_build_profile(profile):
+    """
+    Read the timing entries from a build profile.
+    """
+    entries = []
+    try:
+        with open(profile) as f:
+            for line in f:
+                try:
+                    entries.append(json.loads(line))
+                except ValueError:
+                    continue
+    except IOError:
+        pass
+    return entries
+
+
+def read_build_manifest(manifest, since=None):
+    """
+    Read the latest entry for each log in a build log manifest, optionally
+    only the logs written since the given time.
+    """
+    entries = collections.OrderedDict()
+    try:
+        with open(manifest) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                entries.pop(entry['log'], None)
+                entries[entry['log']] = entry
+    except IOError:
+        return []
+    return [entry for entry in entries.values()
+            if since is None or entry['time'] >= since]
+
+
+def prune_build_profiles(log_dir, keep=BUILD_PROFILE_KEEP):
+    """
+    Remove all but the newest keep build profiles in a log dir.
+    """
+    # the names hold the build time, so they sort oldest first
+    for profile in sorted(glob.glob(log_dir + '/profile_*.jsonl'))[:-keep]:
+        try:
+            os.unlink(profile)
+        except OSError:
+            pass
+
+
+def compact_build_manifest(manifest):
+    """
+    Rewrite a manifest with only the latest entry for each log.
+    """
+    entries = read_build_manifest(manifest)
+    with _manifest_lock:
+        temp_file = manifest + '.tmp'
+        with open(temp_file, 'w') as f:
+            for entry in entries:
+                f.write(json.dumps(entry) + '\n')
+        os.replace(temp_file, manifest)
+
+
+class ActionWrapper(object):
+    """
+    Base of the wrappers SetupBuildEnv puts around the actions of its nodes.
+    Everything but running the action is passed on to the wrapped action so
+    signatures and command printing are unchanged.
+    """
+
+    def __init__(self, action):
+        self.action = action
+
+    def __getattr__(self, name):
+        return getattr(self.action, name)
+
+    def __str__(self):
+        return str(self.action)
+
+    def nodes(self, target, source, kw):
+        """
+        Get the targets and sources an action runs on. SCons runs the
+        actions of an executor with empty lists and the executor in kw.
+        """
+        executor = kw.get('executor')
+        if not target and executor:
+            return executor.get_all_targets(), executor.get_all_sources()
+        return target, source
+
+
+def wrap_actions(nodes, wrapper):
+    """
+    Replace each action building nodes with wrapper(action), once for
+    nodes sharing an executor.
+    """
+    executors = []
+    for node in nodes:
+        executor = node.get_executor()
+        if executor not in executors:
+            executors.append(executor)
+            executor.set_action_list([wrapper(action)
+                                      for action in executor.action_list])
+
+
+class LoggedAction(ActionWrapper):
+    """
+    Wraps the compile or link action of a node so each time it runs its log
+    is recorded in the build log manifest and its timing in the build
+    profile, whether it succeeded or not.
+    """
+
+    def __init__(self, action, manifest, log_file, kind, profile=None):
+        ActionWrapper.__init__(self, action)
+        self.manifest = manifest
+        self.log_file = log_file
+        self.kind = kind
+        self.profile = profile
+
+    def __call__(self, target, source, env, *args, **kw):
+        status = 1
+        _spawn_usage.peak_rss = 0
+        start = time.time()
+        try:
+            status = self.action(target, source, env, *args, **kw)
+            return status
+        finally:
+            end = time.time()
+            status = getattr(status, 'status', status) or 0
+            target, source = self.nodes(target, source, kw)
+            if isinstance(self.log_file, list):
+                log_files = self.log_file
+            else:
+                log_files = [self.log_file]
+            for log_file in log_files:
+                try:
+                    size = os.path.getsize(log_file)
+                except OSError:
+                    size = 0
+                record_build_log(self.manifest, {
+                    'log': log_file,
+                    'kind': self.kind,
+                    'target': str(target[0]),
+                    'source': [str(node) for node in source],
+                    'time': end,
+                    'size': size,
+                    'status': status,
+                })
+            if self.profile:
+                record_build_log(self.profile, {
+                    'target': str(target[0]),
+                    'kind': self.kind,
+                    'start': start,
+                    'end': end,
+                    'duration': end - start,
+                    'status': status,
+                    'peak_rss_kb': _spawn_usage.peak_rss,
+                    'deps': [str(node) for node in target[0].children()
+                             if node.has_builder()],
+                })
+
+
+def balance_groups(items, weights, count):
+    """
+    Split items into at most count groups of about the same total weight,
+    placing the heaviest items first each into the lightest group. Each
+    group keeps the original order of its items.
+    """
+    groups = [[] for _ in range(min(count, len(items)))]
+    totals = [0.0] * len(groups)
+    for item in sorted(items, key=lambda item: weights[item], reverse=True):
+        lightest = totals.index(min(totals))
+        groups[lightest].append(item)
+        totals[lightest] += weights[item]
+    return [sorted(group, key=items.index) for group in groups if group]
+
+
+def stable_groups(items, weights, count, previous, group_name):
+    """
+    Split items into at most count named groups, keeping each item in its
+    group from previous, a dict of item to group name, and placing the new
+    items heaviest first into the lightest group. Without previous groups
+    the items are split with balance_groups. group_name gives the name of
+    the group at an index. Each group keeps the original order of its
+    items.
+    """
+    groups = collections.OrderedDict()
+    for item in items:
+        if item in previous:
+            groups.setdefault(previous[item], []).append(item)
+    if not groups:
+        return collections.OrderedDict((group_name(index), group) for index, group
+                                       in enumerate(balance_groups(items, weights, count)))
+
+    index = 0
+    while len(groups) < min(count, len(items)):
+        if group_name(index) not in groups:
+            groups[group_name(index)] = []
+        index += 1
+    totals = dict((name, sum(weights[item] for item in group))
+                  for name, group in groups.items())
+    for item in sorted([item for item in items if item not in previous],
+                       key=lambda item: weights[item], reverse=True):
+        lightest = min(groups, key=lambda name: totals[name])
+        groups[lightest].append(item)
+        totals[lightest] += weights[item]
+    for name in groups:
+        groups[name] = sorted(groups[name], key=items.index)
+    return groups
+
+
+def _compile_durations(log_dir, unity_members={}):
+    """
+    Get the compile time of each object in the last few build profiles, by
+    object name without extension. The time of a unity object is split
+    between the sources in unity_members by their sizes, so sources keep an
+    estimate while they are compiled in unity files.
+    """
+    durations = {}
+    for profile in sorted(glob.glob(log_dir + '/profile_*.jsonl'))[-5:]:
+        for entry in read_build_profile(profile):
+            if entry['kind'] != 'compile':
+                continue
+            name = os.path.splitext(os.path.basename(entry['target']))[0]
+            if name in unity_members:
+                total = sum(size for _, size in unity_members[name]) or 1
+                for member, size in unity_members[name]:
+                    durations[member] = entry['duration'] * size / total
+            else:
+                durations[name] = entry['duration']
+    return durations
+
+
+def unity_sources(env, prog_name, source_files, build_dir, count, exclude=[], rebalance=False):
+    """
+    Group the sources of a target into count generated unity files per
+    language. Sources matching a pattern in exclude are left to compile on
+    their own. Returns the groups as (unity file, sources) and the
+    remaining sources.
+
+    The groups are kept in build_logs/<prog_name>_unity.json and sources
+    stay in their group between builds, so a unity file only changes when
+    its own sources do. New sources go to the lightest group. The groups
+    are balanced again, by the last compile times of the sources or else
+    their sizes, only when rebalance is set or count changes.
+    """
+    log_dir = env['PROJECT_DIR'] + "/" + build_dir + "/build_logs"
+    groups_file = log_dir + "/" + prog_name + "_unity.json"
+    try:
+        with open(groups_file) as f:
+            stored = json.load(f)
+    except (IOError, OSError, ValueError):
+        stored = {}
+    stored_groups = stored.get('groups', {})
+
+    def size(source):
+        return os.path.getsize(env.File(source).abspath)
+
+    def object_name(source):
+        return os.path.splitext(os.path.basename(source))[0]
+
+    unity_members = {}
+    for source, group_name in stored_groups.items():
+        if os.path.isfile(env.File(source).abspath):
+            unity_members.setdefault(group_name, []).append(
+                (object_name(source), size(source)))
+    durations = _compile_durations(log_dir, unity_members)
+    if rebalance or stored.get('count') != count:
+        stored_groups = {}
+
+    separate = []
+    by_language = collections.OrderedDict()
+    for source in source_files:
+        if any(fnmatch.fnmatch(source, pattern) for pattern in exclude):
+            separate.append(source)
+        else:
+            by_language.setdefault(os.path.splitext(
+                source)[1], []).append(source)
+
+    assigned = {}
+    groups = []
+    for ext, sources in by_language.items():
+        if all(object_name(source) in durations for source in sources):
+            weights = dict((source, durations[object_name(source)])
+                           for source in sources)
+        else:
+            weights = dict((source, size(source)) for source in sources)
+
+        prefix = "%s_unity_%s_" % (prog_name, ext[1:])
+        previous = dict((source, group_name) for source, group_name in stored_groups.items()
+                        if group_name.startswith(prefix))
+        members = stable_groups(sources, weights, count, previous,
+                                lambda index: prefix + str(index))
+
+        for name, group in members.items():
+            for source in group:
+                assigned[source] = name
+            if not group:
+                continue
+            if len(group) == 1:
+                separate.append(group[0])
+                continue
+            unity_file = "%s/unity/%s%s" % (build_dir, name, ext)
+            write_unity_file(env['PROJECT_DIR'] + "/" + unity_file,
+                             [env.File(source).abspath for source in group])
+            groups.append((unity_file, group))
+
+    if not os.path.isdir(log_dir):
+        os.makedirs(log_dir)
+    with open(groups_file, 'w') as f:
+        json.dump({'count': count, 'groups': assigned}, f)
+    return groups, [source for source in source_files if source in separate]
+
+
+def write_unity_file(path, sources):
+    """
+    Write a unity file including sources.
+    """
+    write_generated_file(path, ''.join('#include "%s"\n' % source.replace('\\', '/')
+                                       for source in sources))
+
+
+def write_generated_file(path, contents):
+    """
+    Write a file generated while reading the SConscripts, left alone if
+    unchanged so it doesn't rebuild.
+    """
+    try:
+        with open(path) as f:
+            if f.read() == contents:
+                return
+    except IOError:
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+    with open(path, 'w') as f:
+        f.write(contents)
+
+
+# lines giving the context of the diagnostic line after them
+_log_context_re = re.compile(r'^(In file included from |\s+from |.*: (In|At) .*:$)')
+
+
+def split_unity_log(log_file, sources):
+    """
+    Split the compile log of a unity file into the compile logs of the
+    sources it includes, sources being (source path, log file) pairs. Each
+    diagnostic, with its context, code and notes, goes to the first source
+    it names. Diagnostics naming no source, like the include context of
+    the next source, go to the next one that does.
+    """
+    blocks = []
+    context = False
+    try:
+        with open(log_file) as f:
+            for line in f:
+                if blocks and (context or line[:1].isspace() or ': note: ' in line):
+                    blocks[-1].append(line)
+                else:
+                    blocks.append([line])
+                context = bool(_log_context_re.match(line.rstrip('\r\n')))
+    except IOError:
+        pass
+
+    lines = dict((source, []) for source, _ in sources)
+    current = None
+    pending = []
+    for block in blocks:
+        named = [source for line in block for source, _ in sources
+                 if source in line.replace('\\', '/')]
+        if named:
+            current = named[0]
+            lines[current].extend(pending + block)
+            pending = []
+        else:
+            pending.extend(block)
+    if pending and current is not None:
+        lines[current].extend(pending)
+    for source, source_log in sources:
+        with open(source_log, 'w') as f:
+            f.writelines(lines[source])
+
+
+class UnityLogAction(ActionWrapper):
+    """
+    Wraps the compile action of a unity file so its log is split back into
+    the logs of its sources.
+    """
+
+    def __init__(self, action, log_file, sources):
+        ActionWrapper.__init__(self, action)
+        self.log_file = log_file
+        self.sources = sources
+
+    def __call__(self, target, source, env, *args, **kw):
+        try:
+            return self.action(target, source, env, *args, **kw)
+        finally:
+            split_unity_log(self.log_file, self.sources)
+
+
+class CachedCompileAction(ActionWrapper):
+    """
+    Wraps a compile action so the object is copied from the object cache
+    when it was already compiled with the same source and command, and
+    saved to the cache otherwise.
+    """
+
+    def __init__(self, action, cache, log_file, shared, progress=None):
+        ActionWrapper.__init__(self, action)
+        self.cache = cache
+        self.log_file = log_file
+        self.shared = shared
+        self.progress = progress
+
+    def command(self, target, source, env):
+        """
+        The compile command without the paths of this particular object so
+        the same source builds the same key in another build directory.
+        """
+        command = env.subst(self.action.genstring(target, source, env),
+                            0, target, source)
+        for path in [target[0].abspath, str(target[0]), self.log_file,
+                     env.get('PROJECT_DIR', '')]:
+            if path:
+                command = command.replace(path, '')
+        return command
+
+    def __call__(self, target, source, env, *args, **kw):
+        cached = False
+        targets, sources = self.nodes(target, source, kw)
+        try:
+            start = time.time()
+            key = self.cache.Key(env, self.command(targets, sources, env),
+                                 targets, sources, self.shared)
+            if key and self.cache.Restore(key, targets[0].abspath, self.log_file):
+                cached = True
+                return 0
+            self.cache.Miss()
+            status = self.action(target, source, env, *args, **kw)
+            if key and not getattr(status, 'status', status):
+                self.cache.Store(key, targets[0].abspath, self.log_file,
+                                 time.time() - start)
+            return status
+        finally:
+            if self.progress:
+                self.progress.ReportCompile(str(targets[0]), cached)
+
+
+_include_re = re.compile(r'^\s*#\s*include\s*([<"][^>"]+[>"])')
+
+
+def leading_include(path, include_dirs=[]):
+    """
+    Get the first include of a source, before anything other than comments
+    and pragmas, with quoted includes resolved to an absolute path.
+    """
+    in_comment = False
+    try:
+        with open(path, errors='replace') as f:
+            for line in f:
+                stripped = line.strip()
+                if in_comment:
+                    if '*/' not in stripped:
+                        continue
+                    in_comment = False
+                    stripped = stripped.split('*/', 1)[1].strip()
+                if stripped.startswith('/*'):
+                    if '*/' not in stripped:
+                        in_comment = True
+                        continue
+                    stripped = stripped.split('*/', 1)[1].strip()
+                if not stripped or stripped.startswith('//') or stripped.startswith('#pragma'):
+                    continue
+                match = _include_re.match(stripped)
+                if not match:
+                    return None
+                include = match.group(1)
+                if include.startswith('<'):
+                    return include
+                for include_dir in [os.path.dirname(path)] + include_dirs:
+                    header = os.path.join(include_dir, include[1:-1])
+                    if os.path.isfile(header):
+                        return '"' + os.path.abspath(header).replace('\\', '/') + '"'
+                return None
+    except IOError:
+        pass
+    return None
+
+
+def detect_pch_header(env, source_files):
+    """
+    Find the include most sources of a target start with, if at least two
+    and half of them do.
+    """
+    include_dirs = [env.Dir(include_dir).abspath
+                    for include_dir in env.Flatten(env.get('CPPPATH', []))]
+    counts = collections.Counter()
+    for source in source_files:
+        include = leading_include(env.File(source).abspath, include_dirs)
+        if include:
+            counts[include] += 1
+    if not counts:
+        return None
+    include, count = counts.most_common(1)[0]
+    if count < 2 or count * 2 < len(source_files):
+        return None
+    return include
+
+
+def setup_pch(build_env, prog_type, prog_name, source_files, build_dir, pch, win_redirect, linux_redirect):
+    """
+    Precompile a header for a target and make every object of the target
+    use it. pch is the header to precompile or 'auto' to use the most
+    common leading include. The header is included through a generated
+    stub so it can be forced into each compile. Returns the nodes building
+    the precompiled header, the objects to link with it and its log, or
+    None if there is nothing to precompile.
+    """
+    if pch == 'auto':
+        include = detect_pch_header(build_env, source_files)
+        if not include:
+            return None
+    else:
+        include = '"' + build_env.File(pch).abspath.replace('\\', '/') + '"'
+
+    pch_dir = build_env['PROJECT_DIR'] + "/" + build_dir + "/pch"
+    stub = pch_dir + "/" + prog_name + "_pch.h"
+    pch_log = build_env['PROJECT_DIR'] + "/" + build_dir + \
+        "/build_logs/" + prog_name + "_pch_compile.txt"
+    guard = re.sub(r'\W', '_', prog_name).upper() + "_PCH_H"
+    write_generated_file(stub, "#ifndef %s\n#define %s\n#include %s\n#endif\n" %
+                         (guard, guard, include))
+
+    # the header is built with the flags the objects had before it was added
+    pch_env = build_env.Clone()
+    cplusplus = any(os.path.splitext(source)[1] != '.c'
+                    for source in source_files)
+    shared = prog_type == 'shared'
+
+    if os.path.splitext(os.path.basename(build_env.subst('$CXX')))[0].lower() == 'cl':
+        pch_source = pch_dir + "/" + prog_name + "_pch.cpp"
+        write_unity_file(pch_source, [stub])
+        pch_env['PCHCOM'] = pch_env['PCHCOM'] + " " + \
+            win_redirect + " > \"" + pch_log + "\" " + linux_redirect
+        pch_nodes = pch_env.PCH(pch_source)
+        build_env['PCH'] = pch_nodes[0]
+        build_env['PCHSTOP'] = stub
+        build_env.Append(CCFLAGS=['/FI' + stub])
+        return pch_nodes, [pch_nodes[1]], pch_log
+
+    if 'clang' in os.path.basename(build_env.subst('$CXX')):
+        pch_file = stub + ".pch"
+    else:
+        pch_file = stub + ".gch"
+    if cplusplus:
+        command = '$SHCXX -x c++-header -o $TARGET -c $SHCXXFLAGS $SHCCFLAGS $_CCCOMCOM $SOURCES' if shared else \
+            '$CXX -x c++-header -o $TARGET -c $CXXFLAGS $CCFLAGS $_CCCOMCOM $SOURCES'
+    else:
+        command = '$SHCC -x c-header -o $TARGET -c $SHCFLAGS $SHCCFLAGS $_CCCOMCOM $SOURCES' if shared else \
+            '$CC -x c-header -o $TARGET -c $CFLAGS $CCFLAGS $_CCCOMCOM $SOURCES'
+    # the C scanner finds the header's own includes so it is rebuilt when
+    # any of them change
+    pch_nodes = pch_env.Command(pch_file, stub, Action.Action(command + " " + win_redirect + " > \"" + pch_log + "\" " + linux_redirect, '$CXXCOMSTR'),
+                                source_scanner=SCons.Tool.CScanner)
+    build_env.Append(CCFLAGS=['-include', stub])
+    return pch_nodes, [], pch_log
+
+
 class TempFileMungeOutput(TempFileMunge):
 
     def __call__(self, target, source, env, for_signature):
@@ -231,40 +1128,73 @@ class ProgressCounter(object):
     """
     class ProgressBuild():
 
-        def __init__(self, sources, target, static):
+        def __init__(self, sources, target, static, deferred=False):
 
             self.count = 0.0
+            # compiles are reported once done, to tell cache hits apart
+            self.deferred = deferred
             self.progress_sources = dict()
             self.target = None
             self.target_reported = False
             self.target_install = ''
             for source in sources:
                 # print("Making key: " + os.path.splitext(source)[0])
-                self.progress_sources[os.path.splitext(source)[0]] = False
+                self.progress_sources[os.path.splitext(
+                    source)[0].replace("\\", "/")] = False
             self.target = target
             if static:
                 self.static_lib = "-static"
             else:
                 self.static_lib = ""
 
+    # TODO: make hanlding this file extensions better
+    object_suffixes = (".obj", ".o", ".os")
+
     def __init__(self):
         self.printer = ColorPrinter()
         self.progress_builders = []
-
-    def AddBuild(self, env, sources, target, static=False):
+        # builds by target file name, and by object path without extension,
+        # so each node is matched with dict lookups
+        self.target_index = {}
+        self.source_index = {}
+        # sources compiled together in unity files, by unity object path
+        # without extension
+        self.unity_index = {}
+        # ReportCompile runs on the job threads
+        self.lock = threading.Lock()
+
+    def AddBuild(self, env, sources, target, static=False, deferred=False):
         env['PROJECT_DIR'] = env.get(
             'PROJECT_DIR', env.Dir('.').abspath)
         # self.printer.SetSize(self.target_name_size)
         # pathed_sources = [env.File(source).abspath.replace('\\', '/').replace(env['PROJECT_DIR'] + '/', '')
         #                  for source in sources]
-        self.progress_builders.append(
-            self.ProgressBuild(sources, target, static))
+        build = self.ProgressBuild(sources, target, static, deferred)
+        self.progress_builders.append(build)
+        self.target_index.setdefault(
+            os.path.basename(target), []).append(build)
+        for source in build.progress_sources:
+            self.source_index.setdefault(source, []).append(build)
+
+    def AddUnityGroup(self, unity_file, sources):
+        self.unity_index[os.path.splitext(unity_file)[0].replace("\\", "/")] = [
+            os.path.splitext(source)[0].replace("\\", "/") for source in sources]
+
+    def sourceNodes(self, slashed_node):
+        """
+        Get the object paths a compiled node stands for, the objects of each
+        source in a unity file.
+        """
+        slashed_node_file, ext = os.path.splitext(slashed_node)
+        if slashed_node_file in self.unity_index:
+            return [source + ext for source in self.unity_index[slashed_node_file]]
+        return [slashed_node]
 
     def __call__(self, node, *args, **kw):
         # print(str(node))
 
         slashed_node = str(node).replace("\\", "/")
-        for build in self.progress_builders:
+        for build in self.target_index.get(os.path.basename(slashed_node), []):
 
             # print(build.target + ": "+str(node.get_state())+" - " + slashed_node)
             if(slashed_node.endswith(build.target)):
@@ -283,42 +1213,58 @@ class ProgressCounter(object):
                     self.printer.LinkPrint(
                         target_name, "Skipping, already built " + filename)
                     build.target_reported = True
-        # TODO: make hanlding this file extensions better
-        if(slashed_node.endswith(".obj")
-           or slashed_node.endswith(".o")
-           or slashed_node.endswith(".os")):
-
-            slashed_node_file = os.path.splitext(slashed_node)[0]
-            # print(" - " + slashed_node_file)
-            for build in self.progress_builders:
-                try:
-                    if(not build.progress_sources[slashed_node_file]):
-                        build.progress_sources[slashed_node_file] = True
-                        target_name = os.path.splitext(build.target)[
-                            0] + build.static_lib
-
-                        if(build.count == 0):
-                            self.printer.InfoPrint(
-                                self.printer.OKBLUE + "[ " + target_name + " ]" + self.printer.ENDC + " Building " + build.target)
-
-                        build.count += 1
-                        percent = build.count / \
-                            len(build.progress_sources.keys()) * 100.00
-                        filename = os.path.basename(slashed_node)
-
-                        if(node.get_state() == 2):
-                            self.printer.CompilePrint(
-                                percent, target_name, "Compiling " + filename)
-                        else:
-                            self.printer.CompilePrint(
-                                percent, target_name, "Skipping, already built " + filename)
 
+        if slashed_node.endswith(self.object_suffixes):
+            building = node.get_state() == 2
+            for source_node in self.sourceNodes(slashed_node):
+                for build in self.source_index.get(os.path.splitext(source_node)[0], []):
+                    if building and build.deferred:
+                        break
+                    if self.reportSource(build, source_node, "Compiling " if building else "Skipping, already built "):
                         break
-                except KeyError:
-                    pass
-
 
-def SetupBuildEnv(env, progress, prog_type, prog_name, source_files, build_dir, install_dir):
+    def ReportCompile(self, node, cached):
+        """
+        Report a compile of a build that defers its compiles, once it is
+        known whether the object came from the object cache.
+        """
+        for source_node in self.sourceNodes(str(node).replace("\\", "/")):
+            for build in self.source_index.get(os.path.splitext(source_node)[0], []):
+                if build.deferred and self.reportSource(build, source_node, "Cached " if cached else "Compiling "):
+                    break
+
+    def reportSource(self, build, slashed_node, message):
+        slashed_node_file = os.path.splitext(slashed_node)[0]
+        with self.lock:
+            if(build.progress_sources[slashed_node_file]):
+                return False
+            build.progress_sources[slashed_node_file] = True
+            target_name = os.path.splitext(build.target)[
+                0] + build.static_lib
+
+            if(build.count == 0):
+                self.printer.InfoPrint(
+                    self.printer.OKBLUE + "[ " + target_name + " ]" + self.printer.ENDC + " Building " + build.target)
+
+            build.count += 1
+            percent = build.count / \
+                len(build.progress_sources) * 100.00
+            filename = os.path.basename(slashed_node)
+            self.printer.CompilePrint(percent, target_name, message + filename)
+        return True
+
+
+def SetupBuildEnv(env, progress, prog_type, prog_name, source_files, build_dir, install_dir, object_cache=False,
+                  unity=0, unity_exclude=[], unity_rebalance=False, pch=None):
+    """
+    Setup the environment and nodes to build a program or library, with
+    each compile and link writing its output to a log. With object_cache
+    objects are shared between builds through the ObjectCache. With unity
+    the sources are compiled in that many unity files per language, except
+    those matching a pattern in unity_exclude, with unity_rebalance to
+    regroup them. pch is a header to precompile for the target, or 'auto'
+    to find one.
+    """
 
     build_env = env.Clone()
     # build_env.Execute(Mkdir(install_dir))
@@ -350,39 +1296,99 @@ def SetupBuildEnv(env, progress, prog_type, prog_name, source_files, build_dir,
                 #os.unlink(os.path.join(root, name))
                 pass
 
+    # set before any env is cloned from build_env, like the one building
+    # the precompiled header
+    build_env['BUILD_LOG_TIME'] = build_log_time()
+    if sys.platform != 'win32' and hasattr(os, 'wait4'):
+        build_env['SPAWN'] = rusage_spawn(build_env['SPAWN'])
+
+    def print_cmd_line(s, targets, sources, env):
+        with open(env['PROJECT_DIR'] + "/" + build_dir + "/build_logs/build_" + env['BUILD_LOG_TIME'] + ".log", "a") as f:
+            f.write(s + "\n")
+
+    try:
+        print_cmd = GetOption('option_verbose')
+    except AttributeError:
+        print_cmd = False
+
+    if not print_cmd:
+        build_env['PRINT_CMD_LINE_FUNC'] = print_cmd_line
+
     source_objs = []
     source_build_files = []
+    # (nodes, log file, kind) of the actions recorded in the log manifest
+    logged_nodes = []
+    pch_nodes = None
+    if pch and prog_type in ['shared', 'static', 'exec']:
+        pch_setup = setup_pch(build_env, prog_type, prog_name, source_files,
+                              build_dir, pch, win_redirect, linux_redirect)
+        if pch_setup:
+            pch_nodes, pch_objs, pch_log = pch_setup
+            source_objs.extend(pch_objs)
+            logged_nodes.append((pch_nodes, pch_log, 'compile'))
+
+    unity_groups = []
+    if unity and prog_type in ['shared', 'static', 'exec']:
+        unity_groups, source_files = unity_sources(
+            build_env, prog_name, source_files, build_dir, unity, unity_exclude, unity_rebalance)
+    # unity groups have their logs split back into logs of their sources
+    unity_logs = {}
+
+    compile_files = []
     for file in source_files:
         build_env.VariantDir(
             build_dir + "/" + os.path.dirname(file), os.path.dirname(file), duplicate=0)
 
         file = build_dir + "/" + file
         source_build_files.append(file)
+        compile_files.append((file, []))
+    for unity_file, group in unity_groups:
+        source_build_files.extend(
+            [build_dir + "/" + source for source in group])
+        compile_files.append((unity_file, group))
+
+    for file, group in compile_files:
+        filename = os.path.splitext(os.path.basename(file))[0]
+        compile_log = build_env['PROJECT_DIR'] + "/" + \
+            build_dir + "/build_logs/" + filename + "_compile.txt"
 
         if(prog_type == 'shared'):
             build_obj = build_env.SharedObject(file,
-                                               SHCCCOM=build_env['SHCCCOM'] + " " + win_redirect + " > \"" + build_env['PROJECT_DIR'] + "/" + build_dir + "/build_logs/" + os.path.splitext(
-                                                   os.path.basename(file))[0] + "_compile.txt\" " + linux_redirect,
-                                               SHCXXCOM=build_env['SHCXXCOM'] + " " + win_redirect + " > \"" + build_env['PROJECT_DIR'] + "/" + build_dir + "/build_logs/" + os.path.splitext(os.path.basename(file))[0] + "_compile.txt\" " + linux_redirect)
-            source_objs.append(build_obj)
+                                               SHCCCOM=build_env['SHCCCOM'] + " " + win_redirect +
+                                               " > \"" + compile_log + "\" " + linux_redirect,
+                                               SHCXXCOM=build_env['SHCXXCOM'] + " " + win_redirect + " > \"" + compile_log + "\" " + linux_redirect)
         elif(prog_type == 'static' or prog_type == 'exec'):
-
-            filename = os.path.splitext(os.path.basename(file))[0]
             build_obj = build_env.Object(file,
-                                         CCCOM=build_env['CCCOM'] + " " + win_redirect + " > \"" + build_env['PROJECT_DIR'] +
-                                         "/" + build_dir + "/build_logs/" + filename + "_compile.txt\" " + linux_redirect,
-                                         CXXCOM=build_env['CXXCOM'] + " " + win_redirect + " > \"" + build_env['PROJECT_DIR'] + "/" + build_dir + "/build_logs/" + filename + "_compile.txt\" " + linux_redirect)
-            source_objs.append(build_obj)
+                                         CCCOM=build_env['CCCOM'] + " " + win_redirect +
+                                         " > \"" + compile_log + "\" " + linux_redirect,
+                                         CXXCOM=build_env['CXXCOM'] + " " + win_redirect + " > \"" + compile_log + "\" " + linux_redirect)
+        else:
+            continue
+        source_objs.append(build_obj)
+
+        if group:
+            unity_logs[compile_log] = [(build_env.File(source).abspath.replace('\\', '/'),
+                                        build_env['PROJECT_DIR'] + "/" + build_dir + "/build_logs/" +
+                                        os.path.splitext(os.path.basename(source))[0] + "_compile.txt")
+                                       for source in group]
+            progress.AddUnityGroup(str(build_obj[0]), [
+                                   build_dir + "/" + source for source in group])
+            logged_nodes.append((build_obj, compile_log, 'unity'))
+        else:
+            logged_nodes.append((build_obj, compile_log, 'compile'))
+
+    if pch_nodes:
+        build_env.Depends(source_objs, pch_nodes[0])
 
     if prog_type == 'shared':
         progress.AddBuild(env, source_build_files, env.subst(
-            '$SHLIBPREFIX') + prog_name + env.subst('$SHLIBSUFFIX'))
+            '$SHLIBPREFIX') + prog_name + env.subst('$SHLIBSUFFIX'), deferred=object_cache)
     elif prog_type == 'static':
         progress.AddBuild(env, source_build_files, env.subst(
-            '$LIBPREFIX') + prog_name + env.subst('$LIBSUFFIX'), True)
+            '$LIBPREFIX') + prog_name + env.subst('$LIBSUFFIX'), True, deferred=object_cache)
     elif prog_type == 'exec' or prog_type == 'unit':
         progress.AddBuild(env, source_build_files, env.subst(
-            '$PROGPREFIX') + prog_name + env.subst('$PROGSUFFIX'))
+            '$PROGPREFIX') + prog_name + env.subst('$PROGSUFFIX'), deferred=object_cache)
 
     if(prog_type == 'shared'):
         if sys.platform != 'win32':
@@ -433,11 +1439,21 @@ def SetupBuildEnv(env, progress, prog_type, prog_name, source_files, build_dir,
             build_env['PROJECT_DIR'] + "/" + build_dir + "/" + prog_name, header_files, CXXTEST_RUNNER="ErrorPrinter", CXXTEST_OPTS="--world="+prog_name)
         for exe in prog:
             if os.path.basename(os.path.splitext(str(exe))[0]) == prog_name:
+                _unit_tests.append(exe)
                 for node in exe.children():
                     if os.path.basename(os.path.splitext(str(node))[0]) == prog_name:
                         if sys.platform != 'win32':
                             node.get_executor().set_action_list(Action.Action('$CXX -o $TARGET -c $CXXFLAGS $CCFLAGS $_CCCOMCOM $SOURCES ' + win_redirect +
                                                                               " > \"" + build_env['PROJECT_DIR'] + "/" + build_dir + "/build_logs/" + prog_name + "_compile.txt\" " + linux_redirect, '$CXXCOMSTR'))
+                            logged_nodes.append(([node], build_env['PROJECT_DIR'] + "/" + build_dir +
+                                                 "/build_logs/" + prog_name + "_compile.txt", 'compile'))
+                if sys.platform != 'win32':
+                    logged_nodes.append(([exe], build_env['PROJECT_DIR'] + "/" + build_dir +
+                                         "/build_logs/" + prog_name + "_link.txt", 'link'))
+
+    if prog_type != 'unit' and sys.platform != 'win32':
+        logged_nodes.append((prog, build_env['PROJECT_DIR'] + "/" + build_dir +
+                             "/build_logs/" + prog_name + "_link.txt", 'link'))
 
     if not os.path.exists(build_env['PROJECT_DIR'] + "/" + build_dir + "/build_logs"):
         os.makedirs(build_env['PROJECT_DIR'] + "/" + build_dir + "/build_logs")
@@ -445,21 +1461,28 @@ def SetupBuildEnv(env, progress, prog_type, prog_name, source_files, build_dir,
     # if ARGUMENTS.get('fail', 0):
     #    Command('target', 'source', ['/bin/false'])
 
-    build_env['BUILD_LOG_TIME'] = datetime.datetime.fromtimestamp(
-        time.time()).strftime('%Y_%m_%d__%H_%M_%S')
-
-    def print_cmd_line(s, targets, sources, env):
-        with open(env['PROJECT_DIR'] + "/" + build_dir + "/build_logs/build_" + env['BUILD_LOG_TIME'] + ".log", "a") as f:
-            f.write(s + "\n")
-
-    try:
-        print_cmd = GetOption('option_verbose')
-    except AttributeError:
-        print_cmd = False
-
-    if not print_cmd:
-        build_env['PRINT_CMD_LINE_FUNC'] = print_cmd_line
-
+    manifest = build_env['PROJECT_DIR'] + "/" + \
+        build_dir + "/build_logs/" + BUILD_MANIFEST
+    _build_manifests.add(manifest)
+    profile = build_env['PROJECT_DIR'] + "/" + build_dir + \
+        "/build_logs/profile_" + build_env['BUILD_LOG_TIME'] + ".jsonl"
+    _build_profiles.add(profile)
+    # the first wrapper is innermost, so unity logs are split from what
+    # the compile or the object cache wrote and logging sees the result
+    for nodes, log_file, kind in logged_nodes:
+        # the cache keeps one object per compile, a precompiled header can
+        # build more than one file
+        if object_cache and kind != 'link' and nodes is not pch_nodes:
+            wrap_actions(nodes, lambda action: CachedCompileAction(
+                action, GetObjectCache(), log_file, prog_type == 'shared', progress))
+        if kind == 'unity':
+            wrap_actions(nodes, lambda action: UnityLogAction(
+                action, log_file, unity_logs[log_file]))
+            wrap_actions(nodes, lambda action: LoggedAction(
+                action, manifest, [source_log for _, source_log in unity_logs[log_file]], 'compile', profile))
+        else:
+            wrap_actions(nodes, lambda action: LoggedAction(
+                action, manifest, log_file, kind, profile))
     built_bins = []
     if("Windows" in platform.system()):
         if(prog_type == 'shared'):
@@ -485,21 +1508,239 @@ def SetupBuildEnv(env, progress, prog_type, prog_name, source_files, build_dir,
     return [build_env, prog]
 
 
-def run_unit_tests(base_dir):
+# the CxxTest programs SetupBuildEnv set up during this run
+_unit_tests = []
+
+
+def _is_cxxtest_program(path):
     """
-    Callback function to run the test script.
+    Check if a file is a program built with a CxxTest runner.
+    """
+    if not os.path.isfile(path) or not os.access(path, os.X_OK):
+        return False
+    try:
+        with open(path, 'rb') as f:
+            tail = b''
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                if b'cxxtest' in tail + chunk:
+                    return True
+                tail = chunk[-16:]
+    except IOError:
+        pass
+    return False
+
+
+def discover_unit_tests(base_dir):
+    """
+    Find the unit test programs to run, the CxxTest programs set up by
+    SetupBuildEnv, from build/bin if they were installed there, or else
+    any CxxTest programs in build/bin.
+    """
+    bin_dir = base_dir + '/build/bin'
+    tests = []
+    for exe in _unit_tests:
+        installed = os.path.join(bin_dir, os.path.basename(exe.abspath))
+        if os.path.isfile(installed):
+            tests.append(installed)
+        elif os.path.isfile(exe.abspath):
+            tests.append(exe.abspath)
+    if not tests and os.path.isdir(bin_dir):
+        tests = [os.path.join(bin_dir, name) for name in sorted(os.listdir(bin_dir))
+                 if _is_cxxtest_program(os.path.join(bin_dir, name))]
+    return tests
+
+
+def unit_test_signature(test):
+    """
+    Get a signature of a unit test program that changes when the program
+    or anything it was built from changes. For programs set up by
+    SetupBuildEnv it covers the content signatures SCons keeps for the
+    program and its dependencies, such as the libraries it loads.
+    """
+    signature = hashlib.sha1()
+    for exe in _unit_tests:
+        if os.path.basename(exe.abspath) == os.path.basename(test):
+            for node in [exe] + sorted(exe.children(), key=str):
+                signature.update((str(node) + '=' + node.get_csig() + '\n').encode('utf8'))
+            return signature.hexdigest()
+    try:
+        with open(test, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                signature.update(chunk)
+    except IOError:
+        return None
+    return signature.hexdigest()
+
+
+def load_test_store(store_file):
+    try:
+        with open(store_file) as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return {}
+
+
+def save_test_store(store_file, store):
+    temp_file = store_file + '.tmp'
+    with open(temp_file, 'w') as f:
+        json.dump(store, f)
+    os.replace(temp_file, store_file)
+
+
+def _run_unit_test(test, cwd, test_env, timeout):
+    """
+    Run one unit test program, returns its name, result, time and output.
+    """
+    start = time.time()
+    # in its own process group so anything it started is stopped with it
+    proc = subprocess.Popen([test], cwd=cwd, env=test_env,
+                            stdout=subprocess.PIPE,
+                            stderr=subprocess.STDOUT,
+                            start_new_session=sys.platform != 'win32')
+    try:
+        output = proc.communicate(timeout=timeout)[0]
+        result = 'passed' if proc.returncode == 0 else 'failed'
+    except subprocess.TimeoutExpired:
+        if sys.platform != 'win32':
+            os.killpg(proc.pid, signal.SIGKILL)
+        else:
+            proc.kill()
+        output = proc.communicate()[0]
+        result = 'timeout'
+    return {
+        'name': os.path.splitext(os.path.basename(test))[0],
+        'path': test,
+        'result': result,
+        'duration': time.time() - start,
+        'output': output.decode('utf8', 'replace'),
+    }
+
+
+def write_junit_xml(results, junit_file):
+    """
+    Write unit test results as JUnit XML.
+    """
+    import xml.etree.ElementTree as ET
+    suite = ET.Element('testsuite', {
+        'name': 'unit',
+        'tests': str(len(results)),
+        'failures': str(len([result for result in results if result['result'] == 'failed'])),
+        'errors': str(len([result for result in results if result['result'] == 'timeout'])),
+        'time': '%.3f' % sum(result['duration'] for result in results),
+    })
+    for result in results:
+        case = ET.SubElement(suite, 'testcase', {
+            'classname': 'unit',
+            'name': result['name'],
+            'time': '%.3f' % result['duration'],
+        })
+        if result['result'] == 'failed':
+            ET.SubElement(case, 'failure', {'message': 'failed'}).text = result['output']
+        elif result['result'] == 'timeout':
+            ET.SubElement(case, 'error', {'message': 'timed out'}).text = result['output']
+        ET.SubElement(case, 'system-out').text = result['output']
+    if not os.path.isdir(os.path.dirname(junit_file)):
+        os.makedirs(os.path.dirname(junit_file))
+    ET.ElementTree(suite).write(junit_file, encoding='utf-8', xml_declaration=True)
+
+
+def run_unit_tests(base_dir, jobs=None, timeout=300, junit_file=None, changed_only=False):
+    """
+    Callback function to run the unit tests. The unit test programs are
+    run at the same time on jobs workers, each stopped after timeout
+    seconds, and their results written as JUnit XML to junit_file,
+    build/unit_test_results.xml by default. Without any unit test programs
+    the Testing/run_unit_tests.py script is run instead.
+
+    With changed_only only the tests that changed since they last passed
+    are run, the others keep their last results from
+    build/unit_test_store.json.
     """
 
     test_env = os.environ
     test_env['TEST_BIN_DIR'] = base_dir+'/build/bin'
 
-    proc = subprocess.Popen(
-        args=['python', 'run_unit_tests.py'],
-        cwd=base_dir+'/Testing',
-        env=test_env
-    )
-    output = proc.communicate()[0]
-    # print(output)
+    tests = discover_unit_tests(base_dir)
+    if not tests:
+        proc = subprocess.Popen(
+            args=['python', 'run_unit_tests.py'],
+            cwd=base_dir+'/Testing',
+            env=test_env
+        )
+        proc.communicate()
+        return
+
+    printer = ColorPrinter()
+    if not junit_file:
+        junit_file = base_dir + '/build/unit_test_results.xml'
+
+    def run_test(test):
+        result = _run_unit_test(test, base_dir+'/build/bin', test_env, timeout)
+        if result['result'] == 'passed':
+            printer.TestPassPrint(' %s (%.3fs)' %
+                                  (result['name'], result['duration']))
+        else:
+            printer.TestFailPrint(' %s %s (%.3fs)' % (
+                result['name'], result['result'], result['duration']))
+            if result['output'].strip():
+                printer.TestResultPrint(result['output'].rstrip())
+        return result
+
+    store_file = base_dir + '/build/unit_test_store.json'
+    store = load_test_store(store_file)
+    signatures = dict((test, unit_test_signature(test)) for test in tests)
+
+    kept = []
+    if changed_only:
+        run_tests = []
+        for test in tests:
+            last = store.get(os.path.basename(test))
+            if last and last['result'] == 'passed' and last['signature'] == signatures[test]:
+                kept.append(last['results'])
+                printer.TestPassPrint(
+                    ' %s (unchanged, passed last run)' % last['results']['name'])
+            else:
+                run_tests.append(test)
+        tests = run_tests
+
+    # longest first by the last known durations, so the long tests don't
+    # start last and leave the other workers idle at the end
+    known = [store[os.path.basename(test)]['results']['duration']
+             for test in tests if os.path.basename(test) in store]
+    default_duration = sum(known) / len(known) if known else 0.0
+    durations = dict((test, store[os.path.basename(test)]['results']['duration']
+                      if os.path.basename(test) in store else default_duration)
+                     for test in tests)
+    tests = sorted(tests, key=lambda test: durations[test], reverse=True)
+    workers = min(len(tests), jobs or get_num_cpus())
+
+    start = time.time()
+    results = []
+    if tests:
+        pool = ThreadPool(processes=workers)
+        try:
+            results = pool.map(run_test, tests, chunksize=1)
+        finally:
+            pool.close()
+        if known:
+            predicted = max(sum(durations[test] for test in group)
+                            for group in balance_groups(tests, durations, workers))
+            printer.TestResultPrint(' Predicted %.3f seconds for %d unit tests on %d workers, took %.3f seconds' % (
+                predicted, len(tests), workers, time.time() - start))
+    for test, result in zip(tests, results):
+        store[os.path.basename(test)] = {
+            'signature': signatures[test],
+            'result': result['result'],
+            'results': result,
+        }
+    save_test_store(store_file, store)
+    results = kept + results
+    write_junit_xml(results, junit_file)
+
+    passed = len([result for result in results if result['result'] == 'passed'])
+    printer.TestResultPrint(' %d of %d unit tests passed in %.3f seconds' % (
+        passed, len(results), time.time() - start))
+    return results
 
 
 def run_visual_tests(base_dir):
@@ -534,6 +1775,7 @@ def run_visual_tests(base_dir):
     if 'DISPLAY' not in test_env:
         test_env['DISPLAY'] = ':0'
 
+    start = time.time()
     proc = subprocess.Popen(
         args=['python', 'run_visual_tests.py'],
         cwd=base_dir+'/Testing',
@@ -541,88 +1783,290 @@ def run_visual_tests(base_dir):
     )
     output = proc.communicate()[0]
     # print(output)
+    duration = time.time() - start
+
+    # the visual tests run as one script, so only its total time is known
+    printer = ColorPrinter()
+    store_file = base_dir + '/build/visual_test_store.json'
+    store = load_test_store(store_file)
+    if 'duration' in store:
+        printer.TestResultPrint(' Predicted %.3f seconds for the visual tests, took %.3f seconds' % (
+            store['duration'], duration))
+    save_test_store(store_file, {'duration': duration})
 
 
-def cppcheck_command(base_dir, jobs):
+# cppcheck output template, one finding per line with tab separated fields
+CPPCHECK_TEMPLATE = '{file}\t{line}\t{column}\t{severity}\t{id}\t{message}'
+
+CPPCHECK_NONCRITICAL = ['style', 'performance', 'portability', 'information']
+
+
+class CppcheckFindings(object):
     """
-    Callback function to run the test script.
+    Findings of a cppcheck run, deduplicated and grouped by file and
+    severity, collected from any number of cppcheck processes.
     """
-    printer = ColorPrinter()
-    if "windows" in platform.system().lower():
-        cppcheck_exec = base_dir+'/build/bin/cppcheck.exe'
-    else:
-        cppcheck_exec = './cppcheck'
-
-    def execute():
 
-        proc = subprocess.Popen(
-            [cppcheck_exec,
-                '--enable=all',
-                '--suppress=*:../include/glm*',
-                '-I../include',
-                '-j',
-                str(jobs),
-                '-DGLM_FORCE_RADIANS',
-                '-DODGL_LIBRARAY_BUILD',
-                '../../Core',
-                '../../AppFrameworks'
-             ],
-            cwd=base_dir+'/build/bin',
-            stderr=subprocess.STDOUT,
-            stdout=subprocess.PIPE,
-            universal_newlines=True
-        )
-        for stdout_line in iter(proc.stdout.readline, ""):
-            yield stdout_line
-        proc.stdout.close()
-        return_code = proc.wait()
-        if return_code:
-            raise subprocess.CalledProcessError(return_code, cppcheck_exec)
-
-    style = ' (style) '
-    performance = ' (performance) '
-    portability = ' (portability) '
-    warning = ' (warning) '
-    error = ' (error) '
-    information = ' (information) '
-
-    errors = 0
-    warnings = 0
-    noncritical = 0
-
-    for output in execute():
-        output = output.strip()
-        if(output.startswith('[') or output.endswith(r'% done')):
-
-            if(style in output):
-                noncritical += 1
-                output = printer.highlight_word(
-                    output, ' (style) ', printer.OKBLUE)
-            elif(performance in output):
-                noncritical += 1
-                output = printer.highlight_word(
-                    output, ' (performance) ', printer.OKBLUE)
-            elif(portability in output):
-                noncritical += 1
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.seen = set()
+        self.files = collections.OrderedDict()
+        self.noncritical = 0
+        self.warnings = 0
+        self.errors = 0
+
+    def Add(self, filename, line, column, severity, check_id, message):
+        """
+        Add a finding, returns if it wasn't already reported.
+        """
+        key = (filename, line, column, severity, check_id, message)
+        with self.lock:
+            if key in self.seen:
+                return False
+            self.seen.add(key)
+            self.files.setdefault(filename, collections.OrderedDict()).setdefault(severity, []).append({
+                'line': line,
+                'column': column,
+                'id': check_id,
+                'message': message,
+            })
+            if severity in CPPCHECK_NONCRITICAL:
+                self.noncritical += 1
+            elif severity == 'warning':
+                self.warnings += 1
+            elif severity == 'error':
+                self.errors += 1
+        return True
+
+    def Write(self, findings_file):
+        with self.lock:
+            findings = {
+                'files': self.files,
+                'counts': {
+                    'noncritical': self.noncritical,
+                    'warnings': self.warnings,
+                    'errors': self.errors,
+                },
+            }
+        if not os.path.isdir(os.path.dirname(findings_file)):
+            os.makedirs(os.path.dirname(findings_file))
+        with open(findings_file, 'w') as f:
+            json.dump(findings, f, indent=2)
+
+
+def _stream_cppcheck(printer, findings, args, cwd):
+    """
+    Run cppcheck and print its findings as they are parsed from its output.
+    """
+    proc = subprocess.Popen(
+        args,
+        cwd=cwd,
+        stderr=subprocess.STDOUT,
+        stdout=subprocess.PIPE,
+        universal_newlines=True
+    )
+    for output in proc.stdout:
+        fields = output.rstrip('\r\n').split('\t', 5)
+        if len(fields) == 6 and fields[1].isdigit():
+            filename, line, column, severity, check_id, message = fields
+            if not findings.Add(filename, line, column, severity, check_id, message):
+                continue
+            output = '[' + filename + ':' + line + ']: (' + \
+                severity + ') ' + message
+            if severity in CPPCHECK_NONCRITICAL:
                 output = printer.highlight_word(
-                    output, ' (portability) ', printer.OKBLUE)
-            elif(warning in output):
-                warnings += 1
+                    output, ' (' + severity + ') ', printer.OKBLUE)
+            elif severity == 'warning':
                 output = printer.highlight_word(
                     output, ' (warning) ', printer.WARNING)
-            elif(error in output):
-                errors += 1
+            elif severity == 'error':
                 output = printer.highlight_word(
                     output, ' (error) ', printer.FAIL)
-            elif(information in output):
-                noncritical += 1
-
             printer.CppCheckPrint(' ' + output)
+        elif output.strip().endswith(r'% done'):
+            printer.CppCheckPrint(' ' + output.strip())
+    proc.stdout.close()
+    return_code = proc.wait()
+    if return_code:
+        raise subprocess.CalledProcessError(return_code, args[0])
+
+
+CPPCHECK_SOURCE_SUFFIXES = ('.c', '.cpp', '.cc', '.cxx', '.c++')
+
+
+def cppcheck_shard_weights(cwd, sources, times_file):
+    """
+    List the files cppcheck checks in sources and weigh them by their
+    estimated time in the last sharded run, or else their size.
+    """
+    files = []
+    for source in sources:
+        path = os.path.join(cwd, source)
+        if os.path.isfile(path):
+            files.append(source)
+            continue
+        for root, dirs, names in os.walk(path):
+            dirs.sort()
+            for name in sorted(names):
+                if name.lower().endswith(CPPCHECK_SOURCE_SUFFIXES):
+                    files.append(os.path.relpath(
+                        os.path.join(root, name), cwd).replace('\\', '/'))
+    try:
+        with open(times_file) as f:
+            times = json.load(f)
+    except (IOError, OSError, ValueError):
+        times = {}
+    if files and all(name in times for name in files):
+        return files, dict((name, times[name]) for name in files)
+    return files, dict((name, os.path.getsize(os.path.join(cwd, name))) for name in files)
+
+
+def cppcheck_shards(cwd, sources, count, times_file, shards_file, rebalance=False):
+    """
+    Split the files cppcheck checks into count shards, returns the files of
+    each shard by its name. Files stay in their shard from the last run so
+    each shard's cppcheck build dir keeps their results, new files go to
+    the lightest shard. The shards are balanced again only with rebalance
+    or when count changes.
+    """
+    files, weights = cppcheck_shard_weights(cwd, sources, times_file)
+    try:
+        with open(shards_file) as f:
+            stored = json.load(f)
+    except (IOError, OSError, ValueError):
+        stored = {}
+    previous = {}
+    if not rebalance and stored.get('count') == count:
+        previous = stored.get('shards', {})
+    groups = stable_groups(files, weights, count, previous,
+                           lambda index: 'shard_' + str(index))
+    write_generated_file(shards_file, json.dumps({'count': count, 'shards': dict(
+        (name, group_name) for group_name, group in groups.items() for name in group)}))
+    return collections.OrderedDict((group_name, group) for group_name, group
+                                   in groups.items() if group)
+
+
+def save_cppcheck_times(cwd, shard_files, durations, times_file):
+    """
+    Save an estimate of the time each file took in a sharded run. Only the
+    wall time of each shard is measured, so it is split between the
+    shard's files by their sizes.
+    """
+    times = {}
+    for files, duration in zip(shard_files, durations):
+        sizes = dict((name, os.path.getsize(os.path.join(cwd, name)) or 1)
+                     for name in files)
+        total = sum(sizes.values())
+        for name in files:
+            times[name] = duration * sizes[name] / total
+    with open(times_file, 'w') as f:
+        json.dump(times, f)
+
+
+def cppcheck_command(base_dir, jobs=None, incremental=True,
+                     sources=['../../Core', '../../AppFrameworks'],
+                     includes=['../include'],
+                     defines=['GLM_FORCE_RADIANS', 'ODGL_LIBRARAY_BUILD'],
+                     suppressions=['*:../include/glm*'],
+                     findings_file=None, shard=False, rebalance=False):
+    """
+    Callback function to run the test script. When incremental, cppcheck
+    keeps its per file results in build/cppcheck and only analyses the
+    files that changed, or whose includes changed, since the last run. The
+    results of the unchanged files are still reported.
+
+    Paths are relative to build/bin. The findings are written grouped by
+    file and severity to findings_file, build/cppcheck_findings.json by
+    default. With shard True each source directory is checked by its own
+    cppcheck process at the same time, with shard a number the files are
+    split into that many shards balanced by their sizes or estimated past
+    times. Files keep their shard between runs so the incremental results
+    stay valid, rebalance regroups them.
+    Findings of all shards are merged without duplicates, and
+    unusedFunction is suppressed as no shard sees the whole program.
+    """
+    printer = ColorPrinter()
+    if not jobs:
+        jobs = get_num_cpus()
+    if "windows" in platform.system().lower():
+        cppcheck_exec = base_dir+'/build/bin/cppcheck.exe'
+    else:
+        cppcheck_exec = './cppcheck'
+    if not findings_file:
+        findings_file = base_dir + '/build/cppcheck_findings.json'
+
+    times_file = base_dir + '/build/cppcheck/times.json'
+    shard_files = []
+    if shard is True:
+        shard_names = ['shard_' + str(index) for index in range(len(sources))]
+        shards = [[source] for source in sources]
+    elif shard:
+        shard_groups = cppcheck_shards(base_dir + '/build/bin', sources, shard, times_file,
+                                       base_dir + '/build/cppcheck/shards.json', rebalance)
+        shard_names = list(shard_groups)
+        shard_files = list(shard_groups.values())
+        shards = []
+        for name, files in shard_groups.items():
+            file_list = base_dir + '/build/cppcheck/' + name + '_files.txt'
+            write_generated_file(file_list, ''.join(
+                file_name + '\n' for file_name in files))
+            shards.append(['--file-list=' + file_list])
+    else:
+        shard_names = [None]
+        shards = [sources]
+    if not shards:
+        CppcheckFindings().Write(findings_file)
+        printer.InfoPrint(' Cppcheck found no files to check')
+        return
+    shard_jobs = max(1, jobs // len(shards))
+
+    commands = []
+    for index, shard_sources in enumerate(shards):
+        args = [cppcheck_exec,
+                '--enable=all',
+                '--template=' + CPPCHECK_TEMPLATE,
+                '-j',
+                str(shard_jobs)]
+        args += ['--suppress=' + suppression for suppression in suppressions]
+        if len(shards) > 1:
+            # a shard doesn't see the calls made from the other shards
+            args.append('--suppress=unusedFunction')
+        args += ['-I' + include for include in includes]
+        args += ['-D' + define for define in defines]
+        if incremental:
+            # each shard is its own project as far as cppcheck is concerned,
+            # files keep their shard so its build dir holds their results
+            cppcheck_build_dir = base_dir + '/build/cppcheck'
+            if shard_names[index]:
+                cppcheck_build_dir += '/' + shard_names[index]
+            if not os.path.isdir(cppcheck_build_dir):
+                os.makedirs(cppcheck_build_dir)
+            args.append('--cppcheck-build-dir=' + cppcheck_build_dir)
+        commands.append(args + shard_sources)
+
+    def run_shard(args):
+        start = time.time()
+        _stream_cppcheck(printer, findings, args, base_dir+'/build/bin')
+        return time.time() - start
+
+    findings = CppcheckFindings()
+    if len(commands) == 1:
+        durations = [run_shard(commands[0])]
+    else:
+        pool = ThreadPool(processes=len(commands))
+        try:
+            durations = pool.map(run_shard, commands)
+        finally:
+            pool.close()
+    findings.Write(findings_file)
+    if shard_files:
+        save_cppcheck_times(base_dir + '/build/bin', shard_files,
+                            durations, times_file)
 
     printer.InfoPrint(' Cppcheck finished, findings:')
-    printer.InfoPrint('     Non-Critical: ' + str(noncritical))
-    printer.InfoPrint('     Warnings:     ' + str(warnings))
-    printer.InfoPrint('     Errors:       ' + str(errors))
+    printer.InfoPrint('     Non-Critical: ' + str(findings.noncritical))
+    printer.InfoPrint('     Warnings:     ' + str(findings.warnings))
+    printer.InfoPrint('     Errors:       ' + str(findings.errors))
 
     # TODO: enable once all cppcheck errors are cleaned up
     # if(noncritical + warnings + errors > 0):
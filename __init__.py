@@ -24,30 +24,79 @@ import platform
 import subprocess
 import re
 import sys
+import hashlib
 
 from BuildUtils.ColorPrinter import ColorPrinter
+from BuildUtils.CpuInfo import UsableCpus
 
 
 def get_num_cpus():
     """
-    Function to get the number of CPUs the system has.
+    Function to get the number of CPUs the build may use, after the CPU
+    affinity mask and any cgroup quota.
     """
-    # Linux, Unix and MacOS:
-    if hasattr(os, "sysconf"):
-        if 'SC_NPROCESSORS_ONLN' in os.sysconf_names:
-            # Linux & Unix:
-            ncpus = os.sysconf("SC_NPROCESSORS_ONLN")
-        if isinstance(ncpus, int) and ncpus > 0:
-            return ncpus
-        # OSX:
-        return int(os.popen("sysctl -n hw.ncpu")[1].read())
-    # Windows:
-    if 'NUMBER_OF_PROCESSORS' in os.environ:
-        ncpus = int(os.environ["NUMBER_OF_PROCESSORS"])
-    if ncpus > 0:
-        return ncpus
-    # Default
-    return 1
+    return UsableCpus()
+
+
+def get_cache_dir(name=''):
+    """
+    Function to get the directory for caches kept between builds and
+    checkouts, $BUILDUTILS_CACHE_DIR or ~/.cache/BuildUtils by default.
+    """
+    cache_dir = os.environ.get('BUILDUTILS_CACHE_DIR')
+    if not cache_dir:
+        cache_dir = os.path.join(os.environ.get('XDG_CACHE_HOME', os.path.join(
+            os.path.expanduser('~'), '.cache')), 'BuildUtils')
+    cache_dir = os.path.join(cache_dir, name)
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+    return cache_dir
+
+
+_compiler_versions = {}
+
+
+def get_compiler_version(compiler):
+    """
+    Function to get the version banner of a compiler binary, cached per
+    binary and modification time.
+    """
+    try:
+        mtime = os.path.getmtime(compiler)
+    except OSError:
+        mtime = None
+    if (compiler, mtime) not in _compiler_versions:
+        if os.path.splitext(os.path.basename(compiler))[0].lower() == 'cl':
+            args = [compiler]
+        else:
+            args = [compiler, '--version']
+        try:
+            proc = subprocess.Popen(args,
+                                    stdout=subprocess.PIPE,
+                                    stderr=subprocess.STDOUT)
+            version = proc.communicate()[0].decode('utf8', 'replace')
+        except OSError:
+            version = ''
+        _compiler_versions[(compiler, mtime)] = version
+    return _compiler_versions[(compiler, mtime)]
+
+
+def get_toolchain_fingerprint(env, flag_vars=('CCFLAGS', 'CFLAGS', 'CXXFLAGS',
+                                              'CPPFLAGS', 'CPPDEFINES',
+                                              'LINKFLAGS')):
+    """
+    Function to get a hash identifying the compilers of an environment,
+    their version output and the given flag variables.
+    """
+    fingerprint = hashlib.sha1()
+    for tool in ['CC', 'CXX']:
+        compiler = env.subst('$' + tool)
+        compiler = env.WhereIs(compiler) or compiler
+        fingerprint.update(compiler.encode('utf8'))
+        fingerprint.update(get_compiler_version(compiler).encode('utf8'))
+    for var in flag_vars:
+        fingerprint.update((var + '=' + env.subst('$' + var)).encode('utf8'))
+    return fingerprint.hexdigest()
 
 
 def chmod_build_dir(dirs=['build']):
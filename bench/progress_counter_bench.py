@@ -0,0 +1,190 @@
+# This file is licensed under the MIT License.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+"""
+Benchmark of ProgressCounter replaying a stream of SCons node callbacks.
+
+A stream is recorded in a real build by wrapping the SConstruct's
+ProgressCounter in a NodeRecorder and using it in its place:
+
+    from BuildUtils.bench.progress_counter_bench import NodeRecorder
+    progress = NodeRecorder(ProgressCounter(), 'node_stream.jsonl')
+    Progress(progress, interval=1)
+
+and replayed with:
+
+    python bench/progress_counter_bench.py node_stream.jsonl
+
+The stream holds the builds and unity groups that were added and every node
+with its state.
+Without a stream file a synthetic build of 40 targets and 20000 objects is
+replayed, compiled in --unity unity files per target if given. Run it from
+the directory holding the BuildUtils package, with SCons installed.
+"""
+
+# python
+import os
+import sys
+import json
+import time
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(
+    os.path.dirname(os.path.abspath(__file__)))))
+
+# BuildUtils
+from BuildUtils.SconsUtils import ProgressCounter
+
+
+class NodeRecorder(object):
+    """
+    Wraps a ProgressCounter, writing each build and unity group added and
+    each node with its state to a stream before passing them on.
+    """
+
+    def __init__(self, progress, stream_file):
+        self.progress = progress
+        self.stream = open(stream_file, 'w')
+
+    def AddBuild(self, env, sources, target, static=False, deferred=False):
+        self.stream.write(json.dumps({'build': [list(sources), target, static]}) + '\n')
+        self.progress.AddBuild(env, sources, target, static, deferred)
+
+    def AddUnityGroup(self, unity_file, sources):
+        self.stream.write(json.dumps({'unity': [unity_file, list(sources)]}) + '\n')
+        self.progress.AddUnityGroup(unity_file, sources)
+
+    def __getattr__(self, name):
+        return getattr(self.progress, name)
+
+    def __call__(self, node, *args, **kw):
+        self.stream.write(json.dumps(
+            {'node': str(node), 'state': node.get_state()}) + '\n')
+        self.progress(node, *args, **kw)
+
+
+class ReplayNode(str):
+    """
+    A recorded node, answering what ProgressCounter asks of a node.
+    """
+
+    def __new__(cls, path, state):
+        node = str.__new__(cls, path)
+        node.state = state
+        return node
+
+    def get_state(self):
+        return self.state
+
+
+class ReplayEnv(dict):
+
+    def Dir(self, path):
+        return ReplayDir()
+
+
+class ReplayDir(object):
+    abspath = os.getcwd()
+
+
+class NullPrinter(object):
+    """
+    Stands in for the ColorPrinter so only the node lookups are timed.
+    """
+    OKBLUE = ''
+    ENDC = ''
+
+    def InfoPrint(self, message):
+        pass
+
+    def CompilePrint(self, percent, build, message):
+        pass
+
+    def LinkPrint(self, build, message):
+        pass
+
+
+def synthetic_stream(targets=40, objects=20000, unity=0):
+    builds = []
+    unity_groups = []
+    nodes = []
+    per_target = objects // targets
+    for target in range(targets):
+        sources = ['build/src/lib%d/file%d.cpp' % (target, source)
+                   for source in range(per_target)]
+        builds.append((sources, 'liblib%d.so' % target, False))
+        for source in sources:
+            # SCons evaluates the sources and headers of a node too
+            nodes.append(ReplayNode(source, 0))
+            nodes.append(ReplayNode(source.replace('.cpp', '.h'), 0))
+            if not unity:
+                nodes.append(ReplayNode(source.replace('.cpp', '.os'), 2))
+        for group in range(unity):
+            unity_file = 'build/unity/lib%d_unity_cpp_%d.cpp' % (target, group)
+            unity_groups.append((unity_file, sources[group::unity]))
+            nodes.append(ReplayNode(unity_file.replace('.cpp', '.os'), 2))
+        nodes.append(ReplayNode('build/liblib%d.so' % target, 2))
+    return builds, unity_groups, nodes
+
+
+def load_stream(stream_file):
+    builds = []
+    unity_groups = []
+    nodes = []
+    with open(stream_file) as f:
+        for line in f:
+            entry = json.loads(line)
+            if 'build' in entry:
+                builds.append(tuple(entry['build']))
+            elif 'unity' in entry:
+                unity_groups.append(tuple(entry['unity']))
+            else:
+                nodes.append(ReplayNode(entry['node'], entry['state']))
+    return builds, unity_groups, nodes
+
+
+def replay(builds, unity_groups, nodes, progress=None):
+    if progress is None:
+        progress = ProgressCounter()
+    progress.printer = NullPrinter()
+    env = ReplayEnv()
+    for sources, target, static in builds:
+        progress.AddBuild(env, sources, target, static)
+    for unity_file, sources in unity_groups:
+        progress.AddUnityGroup(unity_file, sources)
+    start = time.time()
+    for node in nodes:
+        progress(node)
+    return time.time() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('stream', nargs='?',
+                        help='recorded node stream, a synthetic one by default')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--unity', type=int, default=0,
+                        help='unity files per target of the synthetic stream')
+    args = parser.parse_args()
+
+    if args.stream:
+        builds, unity_groups, nodes = load_stream(args.stream)
+    else:
+        builds, unity_groups, nodes = synthetic_stream(unity=args.unity)
+    times = [replay(builds, unity_groups, nodes) for _ in range(args.repeat)]
+    best = min(times)
+    print("%d builds, %d unity groups, %d nodes: best %.3fs, %.2fus per node" %
+          (len(builds), len(unity_groups), len(nodes), best, best / max(1, len(nodes)) * 1e6))
+
+
+if __name__ == '__main__':
+    main()
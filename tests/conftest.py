@@ -0,0 +1,40 @@
+# This file is licensed under the MIT License.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+"""
+Makes the checkout importable as the BuildUtils package, whatever the name
+of its directory.
+"""
+
+# python
+import os
+import sys
+import atexit
+import shutil
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# a dir holding only a BuildUtils link to the checkout, for the tests and
+# the SConstructs they run
+PACKAGE_DIR = tempfile.mkdtemp(prefix='buildutils_tests_')
+os.symlink(ROOT, os.path.join(PACKAGE_DIR, 'BuildUtils'))
+sys.path.insert(0, PACKAGE_DIR)
+# rmtree removes the link, not the checkout it points to
+atexit.register(shutil.rmtree, PACKAGE_DIR, True)
+
+
+@pytest.fixture
+def package_dir():
+    return PACKAGE_DIR
@@ -0,0 +1,164 @@
+# This file is licensed under the MIT License.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+"""
+Builds small projects through SetupBuildEnv with SCons.
+"""
+
+# python
+import os
+import sys
+import json
+import shutil
+import subprocess
+
+import pytest
+
+pytest.importorskip('SCons')
+if not shutil.which('g++'):
+    pytest.skip('needs g++', allow_module_level=True)
+
+SCONSTRUCT = """
+import sys
+sys.path.insert(0, %(package_dir)r)
+from BuildUtils.SconsUtils import SetupBuildEnv, ProgressCounter
+env = Environment(CXX='g++', CPPPATH=['#include'])
+progress = ProgressCounter()
+Progress(progress, interval=1)
+SetupBuildEnv(env, progress, 'exec', 'hello', %(sources)r, 'build', 'install'%(options)s)
+%(extra)s"""
+
+
+def write_project(project, package_dir, files, options='', extra=''):
+    for name, contents in files.items():
+        path = project / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(contents)
+    sources = sorted(name for name in files
+                     if name.startswith('src/') and name.endswith('.cpp'))
+    (project / 'SConstruct').write_text(SCONSTRUCT % {
+        'package_dir': package_dir, 'sources': sources, 'options': options, 'extra': extra})
+
+
+def scons(project, env=None):
+    proc = subprocess.run([sys.executable, '-m', 'SCons', '-Q'], cwd=str(project),
+                          stdout=subprocess.PIPE, stderr=subprocess.STDOUT, env=env)
+    output = proc.stdout.decode('utf8', 'replace')
+    assert proc.returncode == 0, output
+    return output
+
+
+def read_jsonl(path):
+    with open(str(path)) as f:
+        return [json.loads(line) for line in f]
+
+
+def test_one_file_program(tmp_path, package_dir):
+    write_project(tmp_path, package_dir, {
+        'src/main.cpp': '#include <cstdio>\nint main() { std::printf("hello\\n"); return 0; }\n'})
+    scons(tmp_path)
+
+    output = subprocess.check_output([str(tmp_path / 'install' / 'hello')])
+    assert output == b'hello\n'
+    entries = read_jsonl(tmp_path / 'build' / 'build_logs' / 'manifest.jsonl')
+    assert [(entry['kind'], entry['target'], entry['status']) for entry in entries] == [
+        ('compile', 'build/src/main.o', 0), ('link', 'build/hello', 0)]
+
+
+def test_object_cache(tmp_path, package_dir):
+    project = tmp_path / 'project'
+    write_project(project, package_dir, {
+        'include/answer.h': 'int answer();\n',
+        'src/main.cpp': '#include "answer.h"\nint main() { return answer() != 42; }\n',
+        'src/answer.cpp': '#include "answer.h"\nint answer() { return 42; }\n'}, ', object_cache=True')
+    env = dict(os.environ, BUILDUTILS_CACHE_DIR=str(tmp_path / 'cache'))
+    assert 'Cached' not in scons(project, env)
+
+    shutil.rmtree(str(project / 'build'))
+    output = scons(project, env)
+    assert 'Cached answer.o' in output and 'Cached main.o' in output
+    subprocess.check_call([str(project / 'install' / 'hello')])
+
+
+def test_one_profile_per_build(tmp_path, package_dir):
+    # the second target is set up a second later, in the same build
+    write_project(tmp_path, package_dir, {
+        'src/main.cpp': 'int main() { return 0; }\n',
+        'other/tool.cpp': 'int main() { return 0; }\n'}, extra="""
+import time
+time.sleep(1.1)
+SetupBuildEnv(env, progress, 'exec', 'tool', ['other/tool.cpp'], 'build', 'install')
+""")
+    scons(tmp_path)
+
+    profiles = list((tmp_path / 'build' / 'build_logs').glob('profile_*.jsonl'))
+    assert len(profiles) == 1
+    targets = sorted(entry['target'] for entry in read_jsonl(profiles[0]))
+    assert targets == ['build/hello', 'build/other/tool.o', 'build/src/main.o', 'build/tool']
+
+
+def test_precompiled_header(tmp_path, package_dir):
+    project = tmp_path / 'project'
+    write_project(project, package_dir, {
+        'include/common.h': '#include <vector>\nint answer();\n',
+        'src/main.cpp': '#include "common.h"\nint main() { return answer() != 42; }\n',
+        'src/answer.cpp': '#include "common.h"\nint answer() { return 42; }\n'},
+        ", object_cache=True, pch='auto'")
+    env = dict(os.environ, BUILDUTILS_CACHE_DIR=str(tmp_path / 'cache'))
+    output = scons(project, env)
+    # the header's command line goes to the build log like the others
+    assert 'c++-header' not in output
+    assert (project / 'build' / 'pch' / 'hello_pch.h.gch').exists()
+
+    profile, = (project / 'build' / 'build_logs').glob('profile_*.jsonl')
+    pch_entry, = [entry for entry in read_jsonl(profile)
+                  if entry['target'].endswith('.gch')]
+    assert pch_entry['peak_rss_kb'] > 0
+
+    shutil.rmtree(str(project / 'build'))
+    output = scons(project, env)
+    # only the objects come from the cache, the header is built again
+    assert 'Cached answer.o' in output and 'Cached main.o' in output
+    assert (project / 'build' / 'pch' / 'hello_pch.h.gch').exists()
+    subprocess.check_call([str(project / 'install' / 'hello')])
+
+
+def test_unity_pch_and_object_cache(tmp_path, package_dir):
+    project = tmp_path / 'project'
+    files = {'include/common.h': '#include <vector>\nint add(int a, int b);\n'}
+    for name in ['main', 'add', 'sub', 'mul']:
+        body = 'int %s(int a, int b) { return a + b; }\n' % name
+        if name == 'main':
+            body = 'int main() { return add(1, 2) != 3; }\n'
+        elif name == 'add':
+            # a warning that must end up in add.cpp's own log
+            body = 'int add(int a, int b) { int unused; return a + b; }\n'
+        files['src/%s.cpp' % name] = '#include "common.h"\n' + body
+    write_project(project, package_dir, files,
+                  ", object_cache=True, unity=2, pch='auto'")
+    (project / 'SConstruct').write_text((project / 'SConstruct').read_text().replace(
+        "CPPPATH=['#include']", "CPPPATH=['#include'], CCFLAGS=['-Wall']"))
+    env = dict(os.environ, BUILDUTILS_CACHE_DIR=str(tmp_path / 'cache'))
+    scons(project, env)
+    subprocess.check_call([str(project / 'install' / 'hello')])
+
+    logs = project / 'build' / 'build_logs'
+    assert 'unused' in (logs / 'add_compile.txt').read_text()
+    assert 'unused' not in (logs / 'sub_compile.txt').read_text()
+    groups = json.loads((logs / 'hello_unity.json').read_text())['groups']
+    assert sorted(groups) == ['src/add.cpp', 'src/main.cpp', 'src/mul.cpp', 'src/sub.cpp']
+    assert len(set(groups.values())) == 2
+
+    shutil.rmtree(str(project / 'build'))
+    output = scons(project, env)
+    assert output.count('Cached') == 4
+    subprocess.check_call([str(project / 'install' / 'hello')])
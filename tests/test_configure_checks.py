@@ -0,0 +1,69 @@
+# This file is licensed under the MIT License.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+"""
+Tests of how cached configure checks record their env changes.
+"""
+
+# python
+import json
+import collections
+
+import pytest
+
+pytest.importorskip('SCons')
+
+from SCons.Environment import Environment
+from SCons.Util import CLVar
+
+from BuildUtils.ConfigureChecks import _EnvChanges, _EnvSnapshot
+
+
+def test_changes_of_values_changed_in_place():
+    env = {'CPPDEFINES': collections.deque(['A']), 'CCFLAGS': CLVar(['-O2'])}
+    before = _EnvSnapshot(env)
+    env['CPPDEFINES'].append(('B', '1'))
+    env['CCFLAGS'].append('-fvisibility=hidden')
+
+    changes = _EnvChanges(before, _EnvSnapshot(env))
+    assert changes == {'CPPDEFINES': ['append', [['B', '1']]],
+                       'CCFLAGS': ['append', ['-fvisibility=hidden']]}
+    json.dumps(changes)
+
+
+def test_replaced_value():
+    env = {'CPPDEFINES': collections.deque(['A'])}
+    before = _EnvSnapshot(env)
+    env['CPPDEFINES'] = collections.deque(['B'])
+
+    changes = _EnvChanges(before, _EnvSnapshot(env))
+    assert changes == {'CPPDEFINES': ['replace', ['B']]}
+    json.dumps(changes)
+
+
+def test_unchanged_env():
+    env = {'CPPDEFINES': collections.deque(['A']), 'CC': 'gcc'}
+    assert _EnvChanges(_EnvSnapshot(env), _EnvSnapshot(env)) == {}
+
+
+def test_replayed_changes_match_the_check():
+    env = Environment(CPPDEFINES=['A'])
+    before = _EnvSnapshot(env)
+    env.Append(CPPDEFINES=['HAVE_HIDDEN', ('NO_SIZE_T', 'long')])
+    changes = json.loads(json.dumps(_EnvChanges(before, _EnvSnapshot(env))))
+
+    replayed = Environment(CPPDEFINES=['A'])
+    for var, (change, value) in changes.items():
+        assert change == 'append'
+        replayed.Append(**{var: value})
+    assert replayed.subst('$_CPPDEFFLAGS') == env.subst('$_CPPDEFFLAGS')
+    assert 'HAVE_HIDDEN' in replayed.subst('$_CPPDEFFLAGS')
@@ -0,0 +1,52 @@
+# This file is licensed under the MIT License.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+"""
+Tests of reading CPU lists and cgroup CPU quotas.
+"""
+
+import pytest
+
+from BuildUtils import CpuInfo
+
+
+@pytest.mark.parametrize('cpulist,cpus', [
+    ('0', [0]),
+    ('0-3', [0, 1, 2, 3]),
+    ('0-1,8-9,12', [0, 1, 8, 9, 12]),
+    ('0-2,\n', [0, 1, 2]),
+    ('', []),
+])
+def test_parse_cpu_list(cpulist, cpus):
+    assert CpuInfo.ParseCpuList(cpulist) == cpus
+
+
+def cgroup(tmp_path, monkeypatch, files):
+    for name, contents in files.items():
+        (tmp_path / name).write_text(contents + '\n')
+    monkeypatch.setattr(CpuInfo, 'CgroupPaths', lambda controller: [str(tmp_path)])
+
+
+@pytest.mark.parametrize('files,limit', [
+    # v2, rounded up to whole CPUs
+    ({'cpu.max': '200000 100000'}, 2),
+    ({'cpu.max': '150000 100000'}, 2),
+    ({'cpu.max': '50000'}, 1),
+    ({'cpu.max': 'max 100000'}, None),
+    # v1
+    ({'cpu.cfs_quota_us': '400000', 'cpu.cfs_period_us': '100000'}, 4),
+    ({'cpu.cfs_quota_us': '-1', 'cpu.cfs_period_us': '100000'}, None),
+    ({}, None),
+])
+def test_cgroup_cpu_limit(tmp_path, monkeypatch, files, limit):
+    cgroup(tmp_path, monkeypatch, files)
+    assert CpuInfo.CgroupCpuLimit() == limit
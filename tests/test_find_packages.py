@@ -0,0 +1,74 @@
+# This file is licensed under the MIT License.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+"""
+Tests of searching for packages in parallel with FindPackages.
+"""
+
+# python
+import time
+
+import pytest
+
+pytest.importorskip('SCons')
+
+from SCons.Environment import Environment
+
+from BuildUtils import FindPackages
+
+
+def pkgconfig_finder(flags):
+    def find(env, paths, required, timeout, conf_dir):
+        env.MergeFlags(flags)
+        return env
+    find.__name__ = 'Find' + flags.split()[0]
+    return find
+
+
+def test_merges_every_changed_variable():
+    env = Environment(CPPPATH=['/base/include'], CCFLAGS=['-O2'])
+    results = FindPackages.FindPackages([
+        pkgconfig_finder('-I/a/include -pthread -DA_DEFINE -La/lib -la'),
+        pkgconfig_finder('-I/b/include -Wl,-rpath=/b/lib -framework Foo -lb')], env)
+
+    assert results == [env, env]
+    assert list(env['CPPPATH']) == ['/base/include', '/a/include', '/b/include']
+    assert '-pthread' in env['CCFLAGS'] and '-O2' in env['CCFLAGS']
+    assert 'A_DEFINE' in list(env['CPPDEFINES'])
+    assert list(env['LIBS']) == ['a', 'b']
+    assert list(env['RPATH']) == ['/b/lib']
+    assert list(env['FRAMEWORKS']) == ['Foo']
+
+
+class RecordingPrinter(object):
+    messages = []
+
+    def InfoPrint(self, message):
+        self.messages.append(('info', message))
+
+    def ErrorPrint(self, message):
+        self.messages.append(('error', message))
+
+
+@pytest.mark.parametrize('required,level', [(True, 'error'), (False, 'info')])
+def test_timeout_before_search(monkeypatch, required, level):
+    monkeypatch.setattr(FindPackages, 'ColorPrinter', RecordingPrinter)
+    monkeypatch.setattr(RecordingPrinter, 'messages', [])
+
+    def slow(env, paths, required, timeout, conf_dir):
+        time.sleep(0.2)
+        return env
+
+    results = FindPackages.FindPackages([slow, pkgconfig_finder('-DLATE')], Environment(),
+                                        required=required, timeout=0.1, jobs=1)
+    assert results[1] is None
+    assert [message[0] for message in RecordingPrinter.messages] == [level]
@@ -0,0 +1,42 @@
+# This file is licensed under the MIT License.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+"""
+Tests recording and replaying a node stream for the ProgressCounter benchmark.
+"""
+
+import pytest
+
+pytest.importorskip('SCons')
+
+from BuildUtils.SconsUtils import ProgressCounter
+from BuildUtils.bench.progress_counter_bench import (
+    NodeRecorder, NullPrinter, ReplayEnv, ReplayNode, load_stream, replay)
+
+
+def test_replays_unity_groups(tmp_path):
+    stream_file = str(tmp_path / 'node_stream.jsonl')
+    progress = ProgressCounter()
+    progress.printer = NullPrinter()
+    recorder = NodeRecorder(progress, stream_file)
+    sources = ['build/src/a.cpp', 'build/src/b.cpp']
+    recorder.AddBuild(ReplayEnv(), sources, 'prog')
+    recorder.AddUnityGroup('build/unity/prog_unity_cpp_0.cpp', sources)
+    recorder(ReplayNode('build/unity/prog_unity_cpp_0.o', 2))
+    recorder.stream.close()
+
+    builds, unity_groups, nodes = load_stream(stream_file)
+    assert unity_groups == [('build/unity/prog_unity_cpp_0.cpp', sources)]
+    replayed = ProgressCounter()
+    replay(builds, unity_groups, nodes, replayed)
+    # the unity object stands for both of its sources
+    assert replayed.progress_builders[0].count == 2
@@ -0,0 +1,138 @@
+# This file is licensed under the MIT License.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+"""
+Tests of the helpers in SconsUtils that don't run a build.
+"""
+
+# python
+import json
+import time
+
+import pytest
+
+pytest.importorskip('SCons')
+
+from BuildUtils import SconsUtils
+
+# gcc's log of a unity file including f3.cpp and f5.cpp, f3.cpp including
+# h3.h
+UNITY_LOG = """\
+In file included from build/unity/prog_unity_cpp_0.cpp:1:
+/project/src/f3.cpp: In function 'int f3()':
+/project/src/f3.cpp:2:20: warning: conversion from 'double' to 'int' changes value [-Wfloat-conversion]
+    2 | int f3() { int y = 1.5; return y; }
+      |                    ^~~
+In file included from build/unity/prog_unity_cpp_0.cpp:2:
+/project/src/f5.cpp: In function 'int f5(int)':
+/project/src/f5.cpp:1:23: warning: suggest parentheses around assignment used as truth value [-Wparentheses]
+    1 | int f5(int a) { if (a = 2) return 1; return 0; }
+      |                     ~~^~~
+/project/src/f5.cpp: In function 'int g5()':
+/project/src/f5.cpp:2:24: error: expected ';' before '}' token
+    2 | int g5() { return f5(1) }
+      |                        ^~
+      |                        ;
+In file included from /project/src/f3.cpp:1:
+/project/src/../inc/h3.h: At global scope:
+/project/src/../inc/h3.h:1:12: warning: 'int unused3()' defined but not used [-Wunused-function]
+    1 | static int unused3() { int x; return x; }
+      |            ^~~~~~~
+"""
+
+
+def split_log(tmp_path, log):
+    log_file = tmp_path / 'unity_compile.txt'
+    log_file.write_text(log)
+    sources = [('/project/src/f3.cpp', str(tmp_path / 'f3_compile.txt')),
+               ('/project/src/f5.cpp', str(tmp_path / 'f5_compile.txt'))]
+    SconsUtils.split_unity_log(str(log_file), sources)
+    return [(tmp_path / name).read_text() for name in ['f3_compile.txt', 'f5_compile.txt']]
+
+
+def test_split_unity_log(tmp_path):
+    f3_log, f5_log = split_log(tmp_path, UNITY_LOG)
+    lines = UNITY_LOG.splitlines(True)
+    assert f3_log == ''.join(lines[0:5] + lines[15:])
+    assert f5_log == ''.join(lines[5:15])
+
+
+def test_split_unity_log_without_diagnostics(tmp_path):
+    assert split_log(tmp_path, '') == ['', '']
+    # a line naming no source goes to the last source named
+    assert split_log(tmp_path, '/project/src/f5.cpp:1:1: warning: w\ncc1plus: note: n\n') == \
+        ['', '/project/src/f5.cpp:1:1: warning: w\ncc1plus: note: n\n']
+
+
+class JobsEnv(dict):
+
+    def Dir(self, path):
+        return type('Dir', (), {'abspath': self['PROJECT_DIR']})()
+
+
+@pytest.fixture
+def host(tmp_path, monkeypatch):
+    """
+    A host with 8 logical CPUs, of which 4 are usable, plenty of memory and
+    no load, the last build's job stats written to job_stats.
+    """
+    state = {'load': 0.0, 'cgroup_limit': None, 'memory': 64 * 1024}
+    monkeypatch.setattr(SconsUtils, 'get_num_cpus', lambda: 4)
+    monkeypatch.setattr(SconsUtils, 'GetCpuInfo', lambda: {
+        'logical': 8, 'usable': 4, 'cgroup_limit': state['cgroup_limit']})
+    monkeypatch.setattr(SconsUtils, '_available_memory_mb', lambda: state['memory'])
+    monkeypatch.setattr(SconsUtils.os, 'getloadavg',
+                        lambda: (state['load'], 0.0, 0.0), raising=False)
+    (tmp_path / 'build').mkdir()
+
+    def job_stats(**stats):
+        (tmp_path / SconsUtils.JOB_STATS_FILE).write_text(json.dumps(stats))
+    state['job_stats'] = job_stats
+    state['env'] = JobsEnv(PROJECT_DIR=str(tmp_path))
+    return state
+
+
+def test_jobs_use_every_usable_cpu(host):
+    assert SconsUtils.select_num_jobs(host['env']) == (4, '4 usable CPUs')
+
+
+def test_jobs_limited_by_memory(host):
+    host['memory'] = 3 * 1024
+    assert SconsUtils.select_num_jobs(host['env'])[0] == 3
+    host['job_stats'](job_memory_mb=2048)
+    jobs, reason = SconsUtils.select_num_jobs(host['env'])
+    assert jobs == 1 and 'learned' in reason
+    assert SconsUtils.select_num_jobs(host['env'], job_memory_mb=512)[0] == 4
+
+
+def test_jobs_limited_by_the_load_on_the_usable_cpus(host):
+    # half the host's load falls on the 4 usable of 8 CPUs
+    host['load'] = 6.0
+    jobs, reason = SconsUtils.select_num_jobs(host['env'])
+    assert jobs == 1 and 'load average' in reason
+    host['load'] = 2.0
+    assert SconsUtils.select_num_jobs(host['env'])[0] == 3
+
+
+def test_jobs_ignore_the_load_under_a_cgroup_quota(host):
+    host['load'] = 16.0
+    host['cgroup_limit'] = 4
+    assert SconsUtils.select_num_jobs(host['env'])[0] == 4
+
+
+def test_jobs_ignore_the_load_of_the_last_build(host):
+    host['load'] = 4.0
+    host['job_stats'](num_jobs=8, time=time.time())
+    assert SconsUtils.select_num_jobs(host['env'])[0] == 4
+    # a minute later the last build only makes up 8 / e of the load average
+    host['job_stats'](num_jobs=8, time=time.time() - 60)
+    assert SconsUtils.select_num_jobs(host['env'])[0] == 3